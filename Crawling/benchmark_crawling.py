@@ -0,0 +1,237 @@
+# Offline benchmark of crawling() against a local HTTP server replaying the pages in fixtures/
+import argparse
+import glob
+import hashlib
+import importlib.util
+import multiprocessing
+import os
+import random
+import re
+import resource
+import threading
+import time
+
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+FIXTURES_DIR = os.path.join(BASE_DIR, "fixtures")
+CRAWLER_PATH = os.path.join(BASE_DIR, "carmudi-crawling-refactored.py")
+
+NOT_FOUND_SUFFIX = "not-found.html"
+FIRST_FOUND_YEAR = 2008 # Queries for older years get the page without listings
+
+LELANG_TYPES = [
+    'AVANZA 1.3 G M/T',
+    'AVANZA 1.3 E M/T',
+    'AVANZA 1.5 G A/T',
+    'AVANZA 1.5 VELOZ A/T',
+    'AVANZA 1.5 VELOZ M/T',
+    'AVANZA 1.3 S AT'
+]
+
+def load_crawler():
+    # The crawler file name is not importable, so it is loaded from its path
+    spec = importlib.util.spec_from_file_location("carmudi_crawling", CRAWLER_PATH)
+    crawler = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(crawler)
+    return crawler
+
+def get_fixture_handler(pages_found, page_not_found, latency, jitter, error_rate, throttle_rate, retry_after):
+    class FixtureHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True # Headers and body are written separately on kept-alive connections
+
+        def do_GET(self):
+            time.sleep(max(0.0, random.gauss(latency, jitter)))
+
+            draw = random.random()
+            if draw < error_rate:
+                return self.send_body(500, b"Injected server error")
+            if draw < error_rate + throttle_rate:
+                return self.send_body(429, b"Injected rate limit", {"Retry-After": str(retry_after)})
+
+            year = re.search(r'year-(\d{4})|year_min=(\d{4})', self.path)
+            year = int(next(group for group in year.groups() if group)) if year else FIRST_FOUND_YEAR
+            if year < FIRST_FOUND_YEAR:
+                return self.send_body(200, page_not_found)
+
+            # The same URL always gets the same recorded page
+            index = int(hashlib.md5(self.path.encode("utf-8")).hexdigest(), 16) % len(pages_found)
+            self.send_body(200, pages_found[index])
+
+        def send_body(self, status, body, headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FixtureHandler
+
+def serve_fixtures(port_queue, fixtures_dir, latency, jitter, error_rate, throttle_rate, retry_after, seed):
+    random.seed(seed)
+    pages_found = []
+    page_not_found = b""
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, "*.html"))):
+        with open(path, "rb") as f:
+            if path.endswith(NOT_FOUND_SUFFIX):
+                page_not_found = f.read()
+            else:
+                pages_found.append(f.read())
+
+    handler = get_fixture_handler(pages_found, page_not_found, latency, jitter, error_rate, throttle_rate, retry_after)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+def start_fixture_server(args):
+    # The server runs in its own process, so it does not share the GIL or the peak RSS of the crawler
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve_fixtures,
+        args=(port_queue, args.fixtures_dir, args.latency, args.jitter, args.error_rate, args.throttle_rate, args.retry_after, args.seed),
+        daemon=True
+    )
+    process.start()
+    return process, f"http://127.0.0.1:{port_queue.get(timeout=10)}"
+
+def get_lelang_dataframe(rows, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Type': rng.choice(LELANG_TYPES, size=rows),
+        'tahun': rng.integers(2005, 2023, size=rows)
+    })
+
+def instrument(crawler, time_parse=True):
+    # Wrap the fetch and parse functions used by crawling() to time every request and every parse,
+    # parsing in a process pool needs the module level parse function so it is not wrapped then
+    latencies = []
+    parse_times = []
+    lock = threading.Lock()
+    fetch_page = crawler.fetch_page
+    parse_listing_page = crawler.parse_listing_page
+
+    def timed_fetch_page(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return fetch_page(*args, **kwargs)
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - start_time)
+
+    def timed_parse_listing_page(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return parse_listing_page(*args, **kwargs)
+        finally:
+            with lock:
+                parse_times.append(time.perf_counter() - start_time)
+
+    crawler.fetch_page = timed_fetch_page
+    if time_parse:
+        crawler.parse_listing_page = timed_parse_listing_page
+    return latencies, parse_times
+
+def run_benchmark(crawler, mode, pool_size, num_shards, args):
+    # Sharded runs crawl in forked processes, their requests and parses are not seen by this process
+    latencies, parse_times = instrument(crawler, time_parse=args.parse_workers == 0)
+    df_lelang = get_lelang_dataframe(args.rows, args.seed)
+
+    error = None
+    rows = 0
+    start_time = time.perf_counter()
+    try:
+        crawling = crawler.crawling if num_shards == 1 else partial(crawler.crawling_sharded, num_shards)
+        df_crawling = crawling(
+            df_lelang=df_lelang,
+            mode=mode,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            burst=args.burst,
+            max_pages=args.max_pages,
+            pool_size=pool_size,
+            parse_workers=args.parse_workers
+        )
+        rows = len(df_crawling)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    wall_time = time.perf_counter() - start_time
+
+    return {
+        'run': (f"{mode}/pool-{pool_size}" if pool_size else f"{mode}/no-pool") + (f"/shards-{num_shards}" if num_shards > 1 else ""),
+        'requests': len(latencies) if num_shards == 1 else float('nan'),
+        'rows': rows,
+        'wall_time': wall_time,
+        'requests_per_second': len(latencies) / wall_time if wall_time > 0 and num_shards == 1 else float('nan'),
+        'latency_p50_ms': np.percentile(latencies, 50) * 1000 if latencies else float('nan'),
+        'latency_p95_ms': np.percentile(latencies, 95) * 1000 if latencies else float('nan'),
+        'latency_p99_ms': np.percentile(latencies, 99) * 1000 if latencies else float('nan'),
+        'parse_total_s': sum(parse_times) if parse_times else float('nan'),
+        'parse_ms_per_page': np.mean(parse_times) * 1000 if parse_times else float('nan'),
+        # Of the process of this run and of its shard processes, ru_maxrss is reported in kilobytes on Linux
+        'peak_rss_mb': max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                           resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024,
+        'error': error
+    }
+
+def run_benchmark_process(mode, pool_size, num_shards, base_url, args, reports):
+    # A fresh module per run, so the instrumentation of one run does not leak into the next one
+    crawler = load_crawler()
+    crawler.CARMUDI_BASE_URL = base_url
+    crawler.SERIAL_SLEEP_SECONDS = args.serial_sleep
+    reports.put(run_benchmark(crawler, mode, pool_size, num_shards, args))
+
+def run_isolated(mode, pool_size, num_shards, base_url, args):
+    # ru_maxrss is a high-water mark of the whole process, every run gets its own spawned process so its peak
+    # RSS is its own and not the maximum of the runs before it
+    context = multiprocessing.get_context("spawn")
+    reports = context.Queue()
+    process = context.Process(target=run_benchmark_process, args=(mode, pool_size, num_shards, base_url, args, reports))
+    process.start()
+    report = reports.get()
+    process.join()
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", type=str, nargs="+", default=["serial", "async"])
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[8, 0]) # 0 opens one connection per request
+    parser.add_argument("--shards", type=int, nargs="+", default=[1]) # Local processes, each crawling a share of the queries
+    parser.add_argument("--rows", type=int, default=2000) # Synthetic lelang rows
+    parser.add_argument("--fixtures-dir", type=str, default=FIXTURES_DIR)
+    parser.add_argument("--latency", type=float, default=0.05) # Seconds added to every response
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0) # Share of 500 responses
+    parser.add_argument("--throttle-rate", type=float, default=0.0) # Share of 429 responses
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=100.0)
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--max-pages", type=int, default=4)
+    parser.add_argument("--parse-workers", type=int, default=0) # Processes parsing pages in async mode
+    parser.add_argument("--serial-sleep", type=float, default=0.0) # The real crawler sleeps 5 seconds every 7 queries
+    parser.add_argument("--seed", type=int, default=293)
+    args = parser.parse_args()
+
+    process, base_url = start_fixture_server(args)
+    try:
+        reports = []
+        for mode in args.modes:
+            for pool_size in args.pool_sizes:
+                for num_shards in args.shards:
+                    reports.append(run_isolated(mode, pool_size, num_shards, base_url, args))
+    finally:
+        process.terminate()
+
+    print()
+    print(pd.DataFrame(reports).set_index('run').T.to_string())
@@ -0,0 +1,54 @@
+# Micro-benchmark of the JSON-LD extractors against the saved carmudi pages in fixtures/
+import argparse
+import glob
+import os
+import time
+
+from parse_util import EXTRACTOR_BS4, EXTRACTORS, EXTRACTORS_ORDER, load_ld_json
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+FIXTURES_DIR = os.path.join(BASE_DIR, "fixtures")
+
+def load_fixtures(fixtures_dir):
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, "*.html"))):
+        with open(path, "rb") as f:
+            pages[os.path.basename(path)] = f.read()
+    return pages
+
+def is_available(extractor):
+    try:
+        EXTRACTORS[extractor]("<html></html>")
+    except ImportError:
+        return False
+    return True
+
+def benchmark_extractor(pages, extractor, repeat):
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for html in pages.values():
+            load_ld_json(html, extractor)
+    return (time.perf_counter() - start_time) / (repeat * len(pages))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures-dir", type=str, default=FIXTURES_DIR)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    pages = load_fixtures(args.fixtures_dir)
+    extractors = [extractor for extractor in EXTRACTORS_ORDER if is_available(extractor)]
+    print(f"Benchmarking {', '.join(extractors)} on {len(pages)} fixture pages, {args.repeat} rounds each")
+
+    # Every extractor must decode exactly the same JSON-LD blocks as the BeautifulSoup baseline
+    for name, html in pages.items():
+        expected = load_ld_json(html, EXTRACTOR_BS4)
+        for extractor in extractors:
+            if load_ld_json(html, extractor) != expected:
+                raise AssertionError(f"Extractor '{extractor}' output differs from '{EXTRACTOR_BS4}' on {name}")
+    print("All extractors return identical output")
+
+    baseline = benchmark_extractor(pages, EXTRACTOR_BS4, args.repeat)
+    for extractor in extractors:
+        seconds_per_page = benchmark_extractor(pages, extractor, args.repeat)
+        print(f"{extractor:>6}: {seconds_per_page * 1000:8.3f} ms/page, {baseline / seconds_per_page:6.1f}x faster than {EXTRACTOR_BS4}")
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+DEFAULT_TTL = 6 * 60 * 60 # Seconds before a cached response has to be revalidated
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+SUFFIX_BODY = '.body'
+SUFFIX_META = '.json'
+
+class ResponseCache:
+    def __init__(self, cache_dir, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Least recently used entries first, the metadata file mtime is the last access time
+        self.entries = OrderedDict()
+        meta_files = [name for name in os.listdir(cache_dir) if name.endswith(SUFFIX_META)]
+        for name in sorted(meta_files, key=lambda name: os.path.getmtime(os.path.join(cache_dir, name))):
+            key = name[:-len(SUFFIX_META)]
+            body_path = self.get_path(key, SUFFIX_BODY)
+            if os.path.exists(body_path):
+                self.entries[key] = os.path.getsize(body_path)
+        self.total_bytes = sum(self.entries.values())
+
+    def get_key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def get_path(self, key, suffix):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def write_file(self, path, content):
+        # Write next to the target then rename, so a crash never leaves a half written entry
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def get(self, url):
+        key = self.get_key(url)
+        with self.lock:
+            if key not in self.entries:
+                return None
+            try:
+                with open(self.get_path(key, SUFFIX_META)) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                self.remove(key)
+                return None
+
+            self.entries.move_to_end(key)
+            os.utime(self.get_path(key, SUFFIX_META))
+            return meta
+
+    def is_fresh(self, meta):
+        return time.time() - meta['stored_at'] < self.ttl
+
+    def read_body(self, url):
+        with open(self.get_path(self.get_key(url), SUFFIX_BODY), 'rb') as f:
+            return f.read()
+
+    def put(self, url, body, headers):
+        key = self.get_key(url)
+        meta = {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'stored_at': time.time(),
+            'size': len(body)
+        }
+
+        with self.lock:
+            self.write_file(self.get_path(key, SUFFIX_BODY), body)
+            self.write_file(self.get_path(key, SUFFIX_META), json.dumps(meta).encode('utf-8'))
+
+            self.total_bytes += len(body) - self.entries.get(key, 0)
+            self.entries[key] = len(body)
+            self.entries.move_to_end(key)
+            self.evict()
+
+    def refresh(self, url, meta):
+        # The server answered 304 Not Modified, so the stored body is fresh again
+        meta['stored_at'] = time.time()
+        with self.lock:
+            self.write_file(self.get_path(self.get_key(url), SUFFIX_META), json.dumps(meta).encode('utf-8'))
+
+    def remove(self, key):
+        self.total_bytes -= self.entries.pop(key, 0)
+        for suffix in [SUFFIX_BODY, SUFFIX_META]:
+            try:
+                os.remove(self.get_path(key, suffix))
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            self.remove(next(iter(self.entries)))
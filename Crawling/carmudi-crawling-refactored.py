@@ -1,197 +1,696 @@
 # Import libraries
 import pandas as pd
 import boto3
-import json
+import argparse
+import asyncio
 import logging
+import re
 import time
 
-from bs4 import BeautifulSoup
-from urllib.request import Request, urlopen
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from time import gmtime, strftime
 from io import StringIO
+from urllib.error import HTTPError
+from cache_util import DEFAULT_MAX_BYTES, DEFAULT_TTL, ResponseCache
+from checkpoint_util import DEFAULT_INTERVAL, CrawlCheckpoint
+from dedup_util import ListingIndex, get_listing_id
+from http_util import DEFAULT_POOL_SIZE, HostRateLimiter, HttpSession, fetch_page, get_cached_page
+from latest_util import get_latest_file, update_latest
+from lelang_util import load_lelang
+from mapping_util import load_catalogue, map_lelang_type
+from output_util import DEFAULT_BATCH_ROWS, ParquetPartitionWriter
+from parse_util import DEFAULT_EXTRACTOR, EXTRACTORS_ORDER, parse_listing_page
+from shard_util import (assign_shards, get_sagemaker_shard, get_shard_name, get_shard_path, read_shard_plans, run_shard_processes,
+                        write_shard_plans)
+from throttle_util import (DEFAULT_BREAKER_COOLDOWN, DEFAULT_BREAKER_THRESHOLD, DEFAULT_INITIAL_CONCURRENCY, DEFAULT_MAX_RETRIES,
+                           AdaptiveThrottle, is_retryable)
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
-DEFAULT = 'default'
+CARMUDI_BASE_URL = 'https://www.carmudi.co.id'
 BRAND = 'toyota'
 VARIANT = 'avanza'
 COL_PRICE = 'price'
 
-TRANSMISSION_MANUAL = 'manual'
-TRANSMISSION_AUTOMATIC = 'automatic'
-
-CAR_TYPE_G = 'G'
-CAR_TYPE_VELOZ = 'VELOZ'
-CAR_TYPE_E = 'E'
-CAR_TYPE_S = 'S'
-
-CC_1_3 = '1.3'
-CC_1_5 = '1.5'
+CRAWL_MODE_SERIAL = 'serial'
+CRAWL_MODE_ASYNC = 'async'
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RATE = 2.0 # Requests per second allowed for each host
+DEFAULT_BURST = 4
+SERIAL_SLEEP_SECONDS = 5 # Pause of the serial crawl every 7 queries
+DEFAULT_PARSE_WORKERS = 0 # Processes parsing pages in async mode, 0 parses in the fetching threads
+DEFAULT_PARSE_QUEUE_SIZE = 16 # Fetched pages waiting to be parsed before the fetchers are held back
+DEFAULT_MAX_YEAR_SPAN = 5 # Maximum number of years merged into one query when coalescing
+DEFAULT_MAX_PAGES = 10 # Maximum number of listing pages fetched for each query
+
+OUTPUT_FORMAT_CSV = 'csv'
+OUTPUT_FORMAT_PARQUET = 'parquet'
+OUTPUT_BUCKET = "glair-exploration-sagemaker-s3-bucket-singapore"
+DEFAULT_PARQUET_URI = f"s3://{OUTPUT_BUCKET}/training/crawling-parquet"
+LELANG_CACHE_URI = f"s3://{OUTPUT_BUCKET}/training/lelang-parquet" # Parquet copies of the lelang uploads, by ETag
+LELANG_CACHE_DIR = "lelang-cache"
+LELANG_SUFFIXES = (".csv", ".xlsx")
 
 COL_TYPE = 'Type'
 COL_TRANSMISI = 'transmisi'
+COL_LISTING_ID = 'listing_id'
 COL_TYPE_DETAIL = 'type_detail'
 COL_CC = 'cc'
 COL_TAHUN = 'tahun'
+COL_BRAND = 'brand'
+COL_VARIANT = 'variant'
 
-map_transmission = {
-    TRANSMISSION_MANUAL: ['M/T', 'MT'],
-    TRANSMISSION_AUTOMATIC:['A/T', 'AT'],
-    DEFAULT: TRANSMISSION_MANUAL
-}
-
-map_car_type = {
-    CAR_TYPE_G: [' G'],
-    CAR_TYPE_VELOZ: [' VELOZ'],
-    CAR_TYPE_E: [' E'],
-    CAR_TYPE_S: [' S'],
-    DEFAULT: CAR_TYPE_E
-}
-
-map_cc = {
-    CC_1_3: ['1.3'],
-    CC_1_5: ['1.5'],
-    DEFAULT: CC_1_3
-}
-
-def get_latest_file(s3_client, bucket_name, prefix_name):
-    s3_uri_response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix_name)
-    try:
-        csv_keys = [obj for obj in s3_uri_response.get("Contents", []) if obj["Key"].endswith(".csv")]
-        latest_file_key = sorted(csv_keys, key=lambda x: x["LastModified"], reverse=True)[0]["Key"]
-    except:
-        excel_keys = [obj for obj in s3_uri_response.get("Contents", []) if obj["Key"].endswith(".xlsx")]
-        latest_file_key = sorted(excel_keys, key=lambda x: x["LastModified"], reverse=True)[0]["Key"]
-    return f"s3://{bucket_name}/{latest_file_key}"
-
-def get_lelang_dataframe(s3_client):
+CrawlQuery = namedtuple('CrawlQuery', ['brand', 'variant', 'transmisi', 'year_from', 'year_to'])
+
+def get_lelang_dataframe(s3_client, brand=BRAND, cache_uri=LELANG_CACHE_URI):
     s3_uri_lelang = get_latest_file(
         s3_client,
         "glair-exploration-sagemaker-s3-bucket-singapore",
-        "glair-bcaf-consultation-input/training/toyota/lelang/"
+        f"glair-bcaf-consultation-input/training/{brand}/lelang/",
+        suffixes=LELANG_SUFFIXES
     )
+    return load_lelang(s3_uri_lelang, cache_uri, s3_client)
 
-    if s3_uri_lelang.endswith(".csv"):
-        bucket_lelang = s3_uri_lelang.split("/")[2]
-        key_lelang = "/".join(s3_uri_lelang.split("/")[3:])
-        file_object = s3_client.get_object(Bucket=bucket_lelang, Key=key_lelang)
+def get_lelang_simple(brand=BRAND, cache_dir=LELANG_CACHE_DIR):
+    return load_lelang("bcaf-lelang.xlsx" if brand == BRAND else f"bcaf-lelang-{brand}.xlsx", cache_dir)
 
-        return pd.read_csv(file_object['Body'], sep=";")
-    elif s3_uri_lelang.endswith(".xlsx"):
-        return pd.read_excel(s3_uri_lelang)
-    else:
-        return "File extension is not supported! File extension must be .csv or .xlsx."
-
-def get_lelang_simple():
-    return pd.read_excel(f"bcaf-lelang.xlsx")
+def get_crawling_prefix(brand):
+    return f"training/{brand}/crawling"
 
-def mapping_label(value, dict_label):
-    for key, labels in dict_label.items():
-        if any(label in value for label in labels):
-            return key
-    return dict_label['default']
+def get_crawling_key(brand, unique_key, shard_name=None):
+    suffix = f"-{shard_name}" if shard_name else ""
+    return f"{get_crawling_prefix(brand)}/{unique_key}/data-crawling-{unique_key}{suffix}.csv"
 
-def get_column_mapping(df, origin_column, dict_label):
-    return df[origin_column].apply(lambda value: mapping_label(value, dict_label))
-
-def save_to_s3(s3_resource, df):
+def save_to_s3(s3_resource, df, brand=BRAND, shard_name=None):
     unique_key = strftime("%Y%m%d", gmtime())
     csv_buffer = StringIO()
     df.to_csv(csv_buffer, index=False)
 
-    bucket = s3_resource.Bucket("glair-exploration-sagemaker-s3-bucket-singapore")
-    return bucket.put_object(Key=f"training/toyota/crawling/{unique_key}/data-crawling-{unique_key}.csv", Body=csv_buffer.getvalue())
+    bucket = s3_resource.Bucket(OUTPUT_BUCKET)
+    response = bucket.put_object(Key=get_crawling_key(brand, unique_key, shard_name), Body=csv_buffer.getvalue())
 
-def crawling():
-    # Get S3 client to get dataframe
-    s3_client = boto3.client("s3", region_name="us-east-1")
+    # Shard files are only inputs of the merge, the merged file becomes the latest crawl
+    if not shard_name:
+        update_latest(s3_resource.meta.client, OUTPUT_BUCKET, response.key, get_crawling_prefix(brand))
+    return response
+
+def save_crawling(df_crawling, shard_name=None):
+    # Get S3 resource to save dataframe
+    s3_resource = boto3.resource("s3", region_name="us-east-1")
+
+    # One file per brand, at the same place as the single brand crawl
+    for brand, df_brand in df_crawling.groupby(COL_BRAND, sort=False):
+        save_to_s3(s3_resource, df_brand.drop(columns=[COL_BRAND]), brand, shard_name)
+
+def merge_shard_outputs(s3_client, brands, unique_key=None):
+    # Concatenate the files saved by every shard of a SageMaker job into the file of the whole crawl
+    unique_key = unique_key or strftime("%Y%m%d", gmtime())
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for brand in brands:
+        prefix = f"{get_crawling_prefix(brand)}/{unique_key}/data-crawling-{unique_key}-shard-"
+        keys = sorted(obj["Key"] for page in paginator.paginate(Bucket=OUTPUT_BUCKET, Prefix=prefix) for obj in page.get("Contents", []))
+        if not keys:
+            print(f"No shard output found for {brand} at s3://{OUTPUT_BUCKET}/{prefix}")
+            continue
+
+        df_brand = pd.concat([pd.read_csv(s3_client.get_object(Bucket=OUTPUT_BUCKET, Key=key)['Body']) for key in keys], ignore_index=True)
+        csv_buffer = StringIO()
+        df_brand.to_csv(csv_buffer, index=False)
+        s3_client.put_object(Bucket=OUTPUT_BUCKET, Key=get_crawling_key(brand, unique_key), Body=csv_buffer.getvalue())
+        update_latest(s3_client, OUTPUT_BUCKET, get_crawling_key(brand, unique_key), get_crawling_prefix(brand))
+        print(f"Merged {len(keys)} shard files of {brand} into {len(df_brand)} rows")
+
+
+def get_carmudi_url(query, page=1):
+    if query.year_from == query.year_to:
+        alamat = f"{CARMUDI_BASE_URL}/en/cars-for-sale/{query.brand}/{query.variant}/year-{query.year_from}/indonesia?transmission={query.transmisi}"
+    else:
+        alamat = f"{CARMUDI_BASE_URL}/en/cars-for-sale/{query.brand}/{query.variant}/indonesia?transmission={query.transmisi}&year_min={query.year_from}&year_max={query.year_to}"
+
+    if page > 1:
+        alamat = f"{alamat}&page={page}"
+    return alamat
+
+def get_query_key(query):
+    # The first page URL identifies a query, including the brand and the variant
+    return get_carmudi_url(query)
+
+def plan_queries(df_lelang, coalesce_years=False, max_year_span=DEFAULT_MAX_YEAR_SPAN):
+    # The carmudi URL only depends on the brand, the variant, 'tahun' and 'transmisi',
+    # so every lelang row maps to one of a few queries
+    df_keys = df_lelang[[COL_BRAND, COL_VARIANT, COL_TRANSMISI, COL_TAHUN]].dropna().drop_duplicates()
+
+    queries = []
+    for (brand, variant, transmisi), tahun in df_keys.groupby([COL_BRAND, COL_VARIANT, COL_TRANSMISI])[COL_TAHUN]:
+        years = sorted(int(year) for year in tahun.unique())
+        if not coalesce_years:
+            queries.extend(CrawlQuery(brand, variant, transmisi, year, year) for year in years)
+            continue
+
+        # Merge consecutive years into ranges of at most 'max_year_span' years
+        year_from = year_to = years[0]
+        for year in years[1:]:
+            if year == year_to + 1 and year - year_from < max_year_span:
+                year_to = year
+            else:
+                queries.append(CrawlQuery(brand, variant, transmisi, year_from, year_to))
+                year_from = year_to = year
+        queries.append(CrawlQuery(brand, variant, transmisi, year_from, year_to))
+
+    return queries
+
+def get_item_price(item):
+    return item['item']['offers']['price']
+
+def get_item_year(item):
+    listing = item['item']
+    for key in ['vehicleModelDate', 'modelDate', 'productionDate']:
+        if key in listing:
+            return int(str(listing[key])[0:4])
+
+    # Listing names start with the year, e.g. "2019 Toyota Avanza 1.3 G"
+    match = re.match(r'\s*(\d{4})\b', listing.get('name', ''))
+    return int(match.group(1)) if match else None
+
+def report_listing(index, alamat, items):
+    if items is None:
+        # logger.info(f"[NOT FOUND] No crawling result found at query number {index} with the address at {alamat}.")
+        print(f"[NOT FOUND] No crawling result found at query number {index} with the address at {alamat}.")
+    else:
+        # logger.info(f"[FOUND] There is a crawling result found at query number {index} with the address at {alamat}")
+        print(f"[FOUND] There is a crawling result found at query number {index} with the address at {alamat}")
+
+def report_failed(alamat, error):
+    # logger.warning(f"[FAILED] The address at {alamat} answered {error.code}, it is skipped.")
+    print(f"[FAILED] The address at {alamat} answered {error.code}, it is skipped.")
+
+def get_listing_dataframe(queries, listings):
+    records = []
+    for query, items in zip(queries, listings):
+        for item in items or []:
+            if query.year_from == query.year_to:
+                tahun = query.year_from
+            else:
+                # A year range query returns several years, each listing goes back to its own year
+                tahun = get_item_year(item)
+                if tahun is None or not query.year_from <= tahun <= query.year_to:
+                    continue
+
+            records.append({
+                COL_BRAND: query.brand,
+                COL_VARIANT: query.variant,
+                COL_TRANSMISI: query.transmisi,
+                COL_TAHUN: tahun,
+                COL_PRICE: get_item_price(item),
+                COL_LISTING_ID: get_listing_id(item)
+            })
+
+    return pd.DataFrame(records, columns=[COL_BRAND, COL_VARIANT, COL_TRANSMISI, COL_TAHUN, COL_PRICE, COL_LISTING_ID])
+
+def fan_out_listings(df_lelang, df_listings):
+    # An inner merge keeps the lelang row order, and the listing order within each row
+    df_crawling = df_lelang.merge(df_listings, on=[COL_BRAND, COL_VARIANT, COL_TAHUN, COL_TRANSMISI], how='inner')
+    df_crawling = df_crawling.rename(columns={COL_TYPE_DETAIL: COL_TYPE})
+
+    # transmisi and listing_id come last, after the columns of the earlier crawls. A listing is repeated for every
+    # lelang row of its query, its ID lets the market index count it once
+    return df_crawling[[COL_PRICE, COL_TAHUN, COL_CC, COL_TYPE, COL_BRAND, COL_VARIANT, COL_TRANSMISI, COL_LISTING_ID]]
+
+def get_next_page_urls(query, page_count, max_pages):
+    return [get_carmudi_url(query, page) for page in range(2, min(page_count, max_pages) + 1)]
+
+def crawl_serial(queries, fetch_html=fetch_page, parse_html=parse_listing_page, max_pages=DEFAULT_MAX_PAGES, on_result=None, throttle=None,
+                 read_cache=None, keep_listings=True):
+    request_listing = lambda alamat: parse_html(fetch_html(alamat))
+
+    # Failed requests are retried with backoff, a single error no longer aborts the crawl
+    if throttle is not None:
+        request_listing = partial(throttle.call, request_listing)
+
+    def fetch_listing(alamat):
+        # Also tells whether a request was sent, a fresh cached page skips the throttle
+        html = read_cache(alamat) if read_cache is not None else None
+        if html is not None:
+            return parse_html(html), False
+        try:
+            return request_listing(alamat), True
+        except HTTPError as e:
+            # A page refused for good (403/404/410) is skipped like a page without listings, the crawl goes on
+            if is_retryable(e):
+                raise
+            report_failed(alamat, e)
+            return (None, 0), True
+
+    listings = []
+    page_total = 0
+    requested_queries = 0
+    for index, query in enumerate(queries):
+        alamat = get_carmudi_url(query)
+        (items, page_count), requested = fetch_listing(alamat)
+        report_listing(index, alamat, items)
+        page_total += 1
+
+        if items is not None:
+            for page_url in get_next_page_urls(query, page_count, max_pages):
+                (page_items, _), page_requested = fetch_listing(page_url)
+                items = items + (page_items or [])
+                requested = requested or page_requested
+                page_total += 1
+
+        # Save results, without 'keep_listings' they only go to 'on_result'
+        listings.append(items if keep_listings else None)
+        if on_result is not None:
+            on_result(query, items)
+
+        # To mimic human behavior, only the queries that sent requests count
+        if requested:
+            if requested_queries % 7 == 0:
+                time.sleep(SERIAL_SLEEP_SECONDS)
+            requested_queries += 1
+
+    return listings, page_total
+
+async def crawl_async(queries, fetch_html=fetch_page, parse_html=parse_listing_page, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE,
+                      burst=DEFAULT_BURST, max_pages=DEFAULT_MAX_PAGES, on_result=None, throttle=None,
+                      parse_workers=DEFAULT_PARSE_WORKERS, parse_queue_size=DEFAULT_PARSE_QUEUE_SIZE, read_cache=None, keep_listings=True):
+    # The token bucket paces requests per host, the throttle adapts the number of requests in flight
+    # up to 'concurrency', backs off and retries on 429/5xx and pauses when the error rate spikes
+    rate_limiter = HostRateLimiter(rate, burst)
+    if throttle is None:
+        throttle = AdaptiveThrottle(concurrency)
+    loop = asyncio.get_running_loop()
+
+    # With parse workers, the fetching threads only download pages and push the raw bytes into a bounded
+    # queue drained by a process pool, so parsing uses every core without stalling the network
+    parse_queue = asyncio.Queue(maxsize=parse_queue_size)
+    # A page holds its slot from its fetch until it is parsed, so fetchers wait when the parsers fall behind
+    pipeline_slots = asyncio.Semaphore(concurrency + parse_queue_size)
+    process_pool = ProcessPoolExecutor(max_workers=parse_workers) if parse_workers > 0 else None
+    fetch_listing = lambda alamat: parse_html(fetch_html(alamat))
+
+    async def parse_worker():
+        while True:
+            html, future = await parse_queue.get()
+            try:
+                future.set_result(await loop.run_in_executor(process_pool, parse_html, html))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                parse_queue.task_done()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        async def run_fetch(alamat):
+            await rate_limiter.acquire_async(alamat)
+            if process_pool is None:
+                return await loop.run_in_executor(executor, fetch_listing, alamat)
+            return await loop.run_in_executor(executor, fetch_html, alamat)
+
+        async def read_cached(alamat):
+            if read_cache is None:
+                return None
+            return await loop.run_in_executor(executor, read_cache, alamat)
+
+        async def request(alamat):
+            try:
+                return await throttle.call_async(run_fetch, alamat)
+            except HTTPError as e:
+                # A page refused for good (403/404/410) is skipped like a page without listings, the crawl goes on
+                if is_retryable(e):
+                    raise
+                report_failed(alamat, e)
+                return None
+
+        async def fetch(alamat):
+            # A fresh cached page is parsed right away, it neither waits for a token nor takes a throttle slot
+            if process_pool is None:
+                html = await read_cached(alamat)
+                if html is not None:
+                    return await loop.run_in_executor(executor, parse_html, html)
+                return await request(alamat) or (None, 0)
+
+            async with pipeline_slots:
+                html = await read_cached(alamat)
+                if html is None:
+                    html = await request(alamat)
+                if html is None:
+                    return None, 0
+                future = loop.create_future()
+                await parse_queue.put((html, future))
+                return await future
+
+        async def crawl_query(index, query):
+            alamat = get_carmudi_url(query)
+            items, page_count = await fetch(alamat)
+            report_listing(index, alamat, items)
+
+            # The first page tells how many pages there are, the remaining ones are fetched together
+            page_urls = get_next_page_urls(query, page_count, max_pages) if items is not None else []
+            for page_items, _ in await asyncio.gather(*(fetch(page_url) for page_url in page_urls)):
+                items = items + (page_items or [])
+
+            if on_result is not None:
+                on_result(query, items)
+            return items if keep_listings else None, 1 + len(page_urls)
+
+        parse_tasks = [asyncio.create_task(parse_worker()) for _ in range(parse_workers)]
+        try:
+            # gather() keeps the query order, so the output matches the serial crawl. A failed query does not
+            # cancel the others, so every query that can finish is checkpointed before the error is raised
+            results = await asyncio.gather(*(crawl_query(index, query) for index, query in enumerate(queries)), return_exceptions=True)
+        finally:
+            for task in parse_tasks:
+                task.cancel()
+            if process_pool is not None:
+                process_pool.shutdown()
+
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+        raise errors[0]
+
+    listings = [items for items, _ in results]
+    page_total = sum(page_count for _, page_count in results)
+    return listings, page_total
+
+def prepare_lelang(df_lelang=None, brands=None, catalogue=None, limit=None, s3_client=None, lelang_cache=LELANG_CACHE_DIR):
+    brands = brands or [BRAND]
 
     # logger.info("Read dataframe...")
     print("Reading dataframe...")
 
-    # Get dataframe
-    # df_lelang = get_lelang_dataframe(s3_client)
-    df_lelang = get_lelang_simple()
-
-    # Extract 'transmisi' from 'Type' column
-    df_lelang[COL_TRANSMISI] = get_column_mapping(df_lelang, COL_TYPE, map_transmission)
-
-    # Extract 'type_detail' from 'Type' column
-    df_lelang[COL_TYPE_DETAIL] = get_column_mapping(df_lelang, COL_TYPE, map_car_type)
-
-    # Extract 'cc' from 'Type' column
-    df_lelang[COL_CC] = get_column_mapping(df_lelang, COL_TYPE, map_cc)
+    # Get dataframe, one lelang file for each brand
+    if df_lelang is None:
+        # df_lelang = pd.concat([get_lelang_dataframe(s3_client, brand).assign(**{COL_BRAND: brand}) for brand in brands], ignore_index=True)
+        df_lelang = pd.concat([get_lelang_simple(brand, lelang_cache).assign(**{COL_BRAND: brand}) for brand in brands], ignore_index=True)
+    elif COL_BRAND not in df_lelang.columns:
+        df_lelang = df_lelang.assign(**{COL_BRAND: brands[0]})
+
+    # Extract 'transmisi', 'variant', 'type_detail' and 'cc' from 'Type' column
+    df_lelang = map_lelang_type(df_lelang, catalogue)
+
+    df_lelang = df_lelang[['type_detail', 'cc', 'tahun', 'transmisi', 'brand', 'variant']]
+
+    # For debug, only crawl the first rows
+    if limit is not None:
+        df_lelang = df_lelang.head(limit)
+
+    return df_lelang
+
+def crawling(df_lelang=None, mode=CRAWL_MODE_SERIAL, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE, burst=DEFAULT_BURST, limit=None,
+             coalesce_years=False, max_year_span=DEFAULT_MAX_YEAR_SPAN, max_pages=DEFAULT_MAX_PAGES,
+             cache_dir=None, cache_ttl=DEFAULT_TTL, cache_max_bytes=DEFAULT_MAX_BYTES, extractor=DEFAULT_EXTRACTOR,
+             checkpoint_path=None, checkpoint_interval=DEFAULT_INTERVAL, resume=False,
+             output_format=None, parquet_uri=DEFAULT_PARQUET_URI, batch_rows=DEFAULT_BATCH_ROWS,
+             initial_concurrency=DEFAULT_INITIAL_CONCURRENCY, max_retries=DEFAULT_MAX_RETRIES,
+             breaker_threshold=DEFAULT_BREAKER_THRESHOLD, breaker_cooldown=DEFAULT_BREAKER_COOLDOWN,
+             pool_size=DEFAULT_POOL_SIZE, http2=False, parse_workers=DEFAULT_PARSE_WORKERS, parse_queue_size=DEFAULT_PARSE_QUEUE_SIZE,
+             brands=None, catalogue=None, num_shards=1, shard_index=None, shard_plan_dir=None, dedup_index=None,
+             lelang_cache=LELANG_CACHE_DIR):
+    # Get S3 client to get dataframe
+    s3_client = boto3.client("s3", region_name="us-east-1")
 
-    df_lelang = df_lelang[['type_detail', 'cc', 'tahun', 'transmisi']]
+    df_lelang = prepare_lelang(df_lelang, brands, catalogue, limit, s3_client, lelang_cache)
+
+    # Plan the distinct queries, each of them is fetched only once
+    queries = plan_queries(df_lelang, coalesce_years, max_year_span)
+    # logger.info(f"Planned {len(queries)} queries for {len(df_lelang)} lelang rows")
+    print(f"Planned {len(queries)} queries for {len(df_lelang)} lelang rows")
+
+    # Only crawl the queries of this shard, from the plan files of a SageMaker job or from the shard index
+    shard_name = None
+    if shard_plan_dir:
+        shard_indexes, num_shards, shard_keys = read_shard_plans(shard_plan_dir)
+        queries = [query for query in queries if get_query_key(query) in shard_keys]
+        shard_name = get_shard_name(shard_indexes, num_shards)
+    elif num_shards > 1:
+        queries = assign_shards(queries, get_query_key, num_shards)[shard_index]
+        shard_name = get_shard_name([shard_index], num_shards)
+
+    if shard_name:
+        # logger.info(f"Crawling {len(queries)} queries of {shard_name}")
+        print(f"Crawling {len(queries)} queries of {shard_name}")
+        if checkpoint_path:
+            checkpoint_path = get_shard_path(checkpoint_path, shard_name)
+
+    # Reuse responses of previous runs, fresh ones are served without any request
+    cache = ResponseCache(cache_dir, cache_ttl, cache_max_bytes) if cache_dir else None
+
+    # Every request goes through the same keep-alive connection pool, a pool size of 0 opens one connection per request
+    session = HttpSession(pool_size, http2=http2) if pool_size > 0 else None
+    fetch_html = partial(fetch_page, cache=cache, session=session)
+    read_cache = partial(get_cached_page, cache=cache) if cache is not None else None
+    parse_html = partial(parse_listing_page, extractor=extractor)
+
+    # Periodically save the finished queries, so a failed run can resume where it stopped
+    checkpoint = None
+    pending_queries = queries
+    if checkpoint_path:
+        checkpoint = CrawlCheckpoint(checkpoint_path, s3_client, checkpoint_interval)
+        if resume:
+            finished = checkpoint.load()
+            pending_queries = [query for query in queries if not checkpoint.is_done(get_query_key(query))]
+            # logger.info(f"Resuming from {checkpoint_path}, {finished} queries already crawled")
+            print(f"Resuming from {checkpoint_path}, {finished} queries already crawled")
+
+    # Stream the results of every finished query into Parquet row groups instead of keeping them until the end
+    # Only emit the listings that are new or repriced since the previous runs
+    listing_index = None
+    deltas = {}
+    if dedup_index:
+        listing_index = ListingIndex(dedup_index, s3_client)
+        # logger.info(f"Loaded {listing_index.load()} listings seen by previous runs from {dedup_index}")
+        print(f"Loaded {listing_index.load()} listings seen by previous runs from {dedup_index}")
+
+    # In Parquet mode the rows of a query are only written to its partitions, nothing is kept for a final DataFrame
+    keep_listings = output_format != OUTPUT_FORMAT_PARQUET
+
+    def get_delta(query, items):
+        # Every query is filtered once, its delta is both streamed to Parquet and kept for the final output
+        if listing_index is None:
+            return items
+        key = get_query_key(query)
+        if key in deltas:
+            return deltas[key]
+        delta = listing_index.filter(items)
+        if keep_listings:
+            deltas[key] = delta
+        return delta
+
+    # One writer for each brand and variant, every shard writes its own part files into the same partitions
+    writers = {}
+
+    def on_result(query, items):
+        if checkpoint is not None:
+            checkpoint.record(get_query_key(query), items)
+        if output_format == OUTPUT_FORMAT_PARQUET:
+            if (query.brand, query.variant) not in writers:
+                writers[(query.brand, query.variant)] = ParquetPartitionWriter(parquet_uri, query.brand, query.variant, s3_client, batch_rows, COL_TAHUN)
+            df_query = fan_out_listings(df_lelang, get_listing_dataframe([query], [get_delta(query, items)]))
+            writers[(query.brand, query.variant)].write(df_query[[COL_PRICE, COL_TAHUN, COL_CC, COL_TYPE, COL_TRANSMISI, COL_LISTING_ID]])
+
+    throttle = AdaptiveThrottle(
+        concurrency,
+        initial_limit=initial_concurrency,
+        max_retries=max_retries,
+        breaker_threshold=breaker_threshold,
+        breaker_cooldown=breaker_cooldown
+    )
 
     # Start crawling
     # logger.info("Starting the crawling process. The time it takes to complete will depend on the internet speed.")
-    print("Starting the crawling process. The time it takes to complete will depend on the internet speed.")
+    print(f"Starting the {mode} crawling process. The time it takes to complete will depend on the internet speed.")
     
     start_time = time.time() # Record the start time
-    results = []
-    for index, row in df_lelang.iterrows():
-        alamat = f"https://www.carmudi.co.id/en/cars-for-sale/{BRAND}/{VARIANT}/year-{row[COL_TAHUN]}/indonesia?transmission={row[COL_TRANSMISI]}"
-        req = Request(alamat, headers={'User-Agent': 'Mozilla/5.0'})
-        html = urlopen(req).read()
-        data = BeautifulSoup(html, 'html.parser')
-        script = data.find_all('script', {'type': 'application/ld+json'})[0]
-
-        # print(json.loads(script.text))
-        script_ = json.loads(script.text)
-        # print(script_)
-        
-        # Check if crawling result exist
-        if isinstance(script_, list) and len(script_) > 0 and 'itemListElement' in script_[0]:
-            # logger.info(f"[FOUND] There is a crawling result found at index number {index} with the address at {alamat}")
-            print(f"[FOUND] There is a crawling result found at index number {index} with the address at {alamat}")
-
-            rows = script_[0]['itemListElement']
-
-            for a in range(len(rows)):
-                harga   = rows[a]['item']['offers']['price']
-                row_hasil = {}
-                row_hasil = {
-                    COL_PRICE: harga,
-                    COL_TAHUN: row[COL_TAHUN],
-                    COL_CC: row[COL_CC],
-                    COL_TYPE: row[COL_TYPE_DETAIL]
-                }
-
-                # Save results
-                results.append(row_hasil)
+    try:
+        if mode == CRAWL_MODE_ASYNC:
+            listings, page_total = asyncio.run(crawl_async(
+                pending_queries, fetch_html, parse_html, concurrency, rate, burst, max_pages, on_result, throttle,
+                parse_workers, parse_queue_size, read_cache, keep_listings
+            ))
         else:
-            # logger.info(f"[NOT FOUND] No crawling result found at index number {index} with the address at {alamat}.")
-            print(f"[NOT FOUND] No crawling result found at index number {index} with the address at {alamat}.")
-
-        # For debug
-        if index == 10:
-            break
-  
-        # To mimic human behavior
-        if index % 7 == 0:
-            time.sleep(5)
+            listings, page_total = crawl_serial(pending_queries, fetch_html, parse_html, max_pages, on_result, throttle, read_cache,
+                                                keep_listings)
+    finally:
+        if checkpoint is not None:
+            checkpoint.save()
+        if writers:
+            for writer in writers.values():
+                writer.close()
+            # logger.info(f"{sum(writer.rows_written for writer in writers.values())} rows written to {parquet_uri}")
+            print(f"{sum(writer.rows_written for writer in writers.values())} rows written to {parquet_uri}")
+
+    if checkpoint is not None and keep_listings:
+        listings = [checkpoint.get(get_query_key(query)) for query in queries]
+
+    if listing_index is not None:
+        if keep_listings:
+            listings = [get_delta(query, items) for query, items in zip(queries, listings)]
+        # Only saved once the run succeeded, a resumed run computes its delta against the same index
+        if shard_name:
+            # The index is shared by every shard, it is merged from their updates once they all finished
+            updated = listing_index.save_updates(shard_name)
+            # logger.info(f"Listings {listing_index.stats}, {updated} listings to merge into {dedup_index}")
+            print(f"Listings {listing_index.stats}, {updated} listings to merge into {dedup_index}")
+        else:
+            indexed = listing_index.save()
+            # logger.info(f"Listings {listing_index.stats}, {indexed} listings indexed")
+            print(f"Listings {listing_index.stats}, {indexed} listings indexed")
 
     end_time = time.time() # Record the end time
     # Calculate the elapsed time
     elapsed_time = end_time - start_time
+    pages_per_second = page_total / elapsed_time if elapsed_time > 0 else 0.0
     # logger.info(f"Crawling process finished after: {elapsed_time:.2f} seconds")
-    print(f"Crawling process finished after: {elapsed_time:.2f} seconds")
+    print(f"Crawling process finished after: {elapsed_time:.2f} seconds ({page_total} pages, {pages_per_second:.2f} pages/sec, {throttle.retries} retries, {throttle.failures} failed pages, mode={mode})")
 
-    df_crawling = pd.DataFrame(results)
-    
-    # Get S3 resource to save dataframe
-    # s3_resource = boto3.resource("s3", region_name="us-east-1")
+    if not keep_listings:
+        # The rows are in the Parquet partitions
+        return None
 
-    # Save dataframe to S3
-    # save_to_s3(s3_resource, df_crawling)
+    # Give the listings of each query back to every lelang row asking for it
+    df_listings = get_listing_dataframe(queries, listings)
+    df_crawling = fan_out_listings(df_lelang, df_listings)
+    
+    if output_format == OUTPUT_FORMAT_CSV:
+        # Save dataframe to S3
+        save_crawling(df_crawling, shard_name)
 
     # logger.info("Dataframe save successfully!")
     print("Dataframe save successfully!")
 
     return df_crawling
 
+def merge_listing_index(dedup_index, s3_client):
+    merged, indexed = ListingIndex(dedup_index, s3_client).merge_updates()
+    # logger.info(f"Merged the listings of {merged} shards into {dedup_index}, {indexed} listings indexed")
+    print(f"Merged the listings of {merged} shards into {dedup_index}, {indexed} listings indexed")
+
+def crawling_sharded(num_shards, output_format=None, **kwargs):
+    # Every shard crawls its share of the queries in its own process with its own connections and rate limit,
+    # the Parquet part files of the shards land in the same partitions and the CSV is saved once merged
+    shard_output_format = None if output_format == OUTPUT_FORMAT_CSV else output_format
+    run_shard = lambda index: crawling(output_format=shard_output_format, num_shards=num_shards, shard_index=index, **kwargs)
+
+    start_time = time.time()
+    outputs = run_shard_processes(run_shard, num_shards)
+    if kwargs.get('dedup_index'):
+        merge_listing_index(kwargs['dedup_index'], boto3.client("s3", region_name="us-east-1"))
+    if shard_output_format == OUTPUT_FORMAT_PARQUET:
+        # Every shard wrote its own part files, no rows come back through the queue
+        print(f"Crawling {num_shards} shards finished after: {time.time() - start_time:.2f} seconds")
+        return None
+
+    df_crawling = pd.concat(outputs, ignore_index=True)
+    # logger.info(f"Crawling {num_shards} shards finished after: {time.time() - start_time:.2f} seconds")
+    print(f"Crawling {num_shards} shards finished after: {time.time() - start_time:.2f} seconds ({len(df_crawling)} rows)")
+
+    if output_format == OUTPUT_FORMAT_CSV:
+        save_crawling(df_crawling)
+
+    return df_crawling
+
 if __name__ == "__main__":
-    crawling()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", type=str, choices=[CRAWL_MODE_SERIAL, CRAWL_MODE_ASYNC], default=CRAWL_MODE_SERIAL)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY) # Upper bound of the adaptive concurrency
+    parser.add_argument("--initial-concurrency", type=int, default=DEFAULT_INITIAL_CONCURRENCY)
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES)
+    parser.add_argument("--breaker-threshold", type=float, default=DEFAULT_BREAKER_THRESHOLD)
+    parser.add_argument("--breaker-cooldown", type=float, default=DEFAULT_BREAKER_COOLDOWN)
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE)
+    parser.add_argument("--burst", type=int, default=DEFAULT_BURST)
+    parser.add_argument("--limit", type=int, default=11)
+    parser.add_argument("--coalesce-years", action="store_true")
+    parser.add_argument("--max-year-span", type=int, default=DEFAULT_MAX_YEAR_SPAN)
+    parser.add_argument("--max-pages", type=int, default=DEFAULT_MAX_PAGES)
+    parser.add_argument("--cache-dir", type=str, default=None)
+    parser.add_argument("--cache-ttl", type=int, default=DEFAULT_TTL)
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024))
+    parser.add_argument("--extractor", type=str, choices=EXTRACTORS_ORDER, default=DEFAULT_EXTRACTOR)
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE)
+    parser.add_argument("--http2", action="store_true")
+    parser.add_argument("--parse-workers", type=int, default=DEFAULT_PARSE_WORKERS)
+    parser.add_argument("--parse-queue-size", type=int, default=DEFAULT_PARSE_QUEUE_SIZE)
+    parser.add_argument("--checkpoint-path", type=str, default=None) # Local path or s3://bucket/key
+    parser.add_argument("--checkpoint-interval", type=int, default=DEFAULT_INTERVAL)
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--output-format", type=str, choices=[OUTPUT_FORMAT_CSV, OUTPUT_FORMAT_PARQUET], default=None)
+    parser.add_argument("--parquet-uri", type=str, default=DEFAULT_PARQUET_URI) # Local directory or s3://bucket/prefix
+    parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS)
+    parser.add_argument("--brands", type=str, nargs="+", default=[BRAND])
+    parser.add_argument("--catalogue", type=str, default=None) # JSON file shaped like mapping_util.CATALOGUE
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument("--shard-index", type=int, default=None) # Without it, the shards run as local processes
+    parser.add_argument("--shard-plan-dir", type=str, default=None) # Plan files received through a ShardedByS3Key input
+    parser.add_argument("--write-shard-plans", type=str, default=None) # Local directory or s3://bucket/prefix
+    parser.add_argument("--merge-shards", action="store_true")
+    parser.add_argument("--lelang-cache", type=str, default=LELANG_CACHE_DIR) # Directory of the Parquet copies of the lelang files
+    parser.add_argument("--dedup-index", type=str, default=None) # Local directory or s3://bucket/prefix of the listings seen before
+    args = parser.parse_args()
+
+    catalogue = load_catalogue(args.catalogue)
+
+    if args.write_shard_plans:
+        # Plan once before the SageMaker job, every instance then crawls the plan file it receives
+        df_lelang = prepare_lelang(None, args.brands, catalogue, args.limit, lelang_cache=args.lelang_cache)
+        queries = plan_queries(df_lelang, args.coalesce_years, args.max_year_span)
+        shards = assign_shards(queries, get_query_key, args.num_shards)
+        paths = write_shard_plans(shards, get_query_key, args.write_shard_plans, boto3.client("s3", region_name="us-east-1"))
+        print(f"Wrote {len(paths)} shard plans of {len(queries)} queries to {args.write_shard_plans}")
+        raise SystemExit(0)
+
+    if args.merge_shards:
+        # After every instance of a SageMaker job finished
+        merge_shard_outputs(boto3.client("s3", region_name="us-east-1"), args.brands)
+        if args.dedup_index:
+            merge_listing_index(args.dedup_index, boto3.client("s3", region_name="us-east-1"))
+        raise SystemExit(0)
+
+    num_shards = args.num_shards
+    shard_index = args.shard_index
+    if num_shards > 1 and shard_index is None and args.shard_plan_dir is None:
+        # On a multi-instance SageMaker job, every instance takes the shard of its host
+        sagemaker_shard = get_sagemaker_shard()
+        if sagemaker_shard is not None:
+            shard_index, num_shards = sagemaker_shard
+
+    if num_shards > 1 and shard_index is None and args.shard_plan_dir is None:
+        run = partial(crawling_sharded, num_shards)
+    else:
+        run = partial(crawling, num_shards=num_shards, shard_index=shard_index, shard_plan_dir=args.shard_plan_dir)
+
+    run(
+        mode=args.mode,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        burst=args.burst,
+        limit=args.limit,
+        coalesce_years=args.coalesce_years,
+        max_year_span=args.max_year_span,
+        max_pages=args.max_pages,
+        cache_dir=args.cache_dir,
+        cache_ttl=args.cache_ttl,
+        cache_max_bytes=args.cache_max_mb * 1024 * 1024,
+        extractor=args.extractor,
+        checkpoint_path=args.checkpoint_path,
+        checkpoint_interval=args.checkpoint_interval,
+        resume=args.resume,
+        output_format=args.output_format,
+        parquet_uri=args.parquet_uri,
+        batch_rows=args.batch_rows,
+        initial_concurrency=args.initial_concurrency,
+        max_retries=args.max_retries,
+        breaker_threshold=args.breaker_threshold,
+        breaker_cooldown=args.breaker_cooldown,
+        pool_size=args.pool_size,
+        http2=args.http2,
+        parse_workers=args.parse_workers,
+        parse_queue_size=args.parse_queue_size,
+        brands=args.brands,
+        catalogue=catalogue,
+        dedup_index=args.dedup_index,
+        lelang_cache=args.lelang_cache
+    )
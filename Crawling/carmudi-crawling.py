@@ -1,7 +1,7 @@
 import boto3
 import pandas as pd
 from bs4 import BeautifulSoup
-from urllib.request import Request, urlopen
+from http_util import HttpSession, fetch_page
 import json
 from time import gmtime, strftime
 
@@ -99,11 +99,13 @@ def crawling():
     CC          = []
     Type        = []
     
+    # Reuse the keep-alive connections to carmudi instead of opening one per request
+    session = HttpSession()
+
     for i in range(20):
         # logger.info(i)
         alamat = f"https://www.carmudi.co.id/en/cars-for-sale/toyota/avanza/year-{year[i]}/indonesia?transmission={transmisi[i]}"
-        req = Request(alamat, headers={'User-Agent': 'Mozilla/5.0'})
-        html = urlopen(req).read()
+        html = fetch_page(alamat, session=session)
         data = BeautifulSoup(html, 'html.parser')
         script = data.find_all('script', {'type': 'application/ld+json'})[0]
     
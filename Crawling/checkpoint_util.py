@@ -0,0 +1,64 @@
+import json
+import os
+import time
+
+DEFAULT_INTERVAL = 20 # Number of finished queries between two checkpoint writes
+
+class CrawlCheckpoint:
+    def __init__(self, path, s3_client=None, interval=DEFAULT_INTERVAL):
+        self.path = path # Local file path or s3://bucket/key
+        self.s3_client = s3_client
+        self.interval = interval
+        self.listings = {}
+        self.pending = 0
+
+    def is_s3(self):
+        return self.path.startswith("s3://")
+
+    def get_bucket_key(self):
+        bucket, key = self.path.replace("s3://", "").split("/", 1)
+        return bucket, key
+
+    def read(self):
+        if self.is_s3():
+            bucket, key = self.get_bucket_key()
+            try:
+                return self.s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+            except self.s3_client.exceptions.NoSuchKey:
+                return None
+
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def load(self):
+        body = self.read()
+        if body is not None:
+            self.listings = json.loads(body)['listings']
+        return len(self.listings)
+
+    def save(self):
+        body = json.dumps({'saved_at': time.time(), 'listings': self.listings}).encode('utf-8')
+        if self.is_s3():
+            bucket, key = self.get_bucket_key()
+            self.s3_client.put_object(Bucket=bucket, Key=key, Body=body)
+        else:
+            # Write next to the target then rename, so a crash never leaves a half written checkpoint
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, self.path)
+        self.pending = 0
+
+    def is_done(self, key):
+        return key in self.listings
+
+    def get(self, key):
+        return self.listings[key]
+
+    def record(self, key, items):
+        self.listings[key] = items
+        self.pending += 1
+        if self.pending >= self.interval:
+            self.save()
@@ -0,0 +1,232 @@
+import glob
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+
+DEFAULT_CAPACITY = 1000000 # Listings the Bloom filter is sized for, it is rebuilt larger once the index outgrows it
+DEFAULT_ERROR_RATE = 0.01
+
+FILE_BLOOM = 'bloom.npy'
+FILE_BLOOM_META = 'bloom.json'
+FILE_IDS = 'index-ids.npy'
+FILE_PRICES = 'index-prices.npy'
+INDEX_FILES = [FILE_BLOOM, FILE_BLOOM_META, FILE_IDS, FILE_PRICES]
+UPDATES_PREFIX = 'updates-' # Followed by the shard name, e.g. updates-shard-00001-of-00004.json
+
+LISTING_ID_PATTERN = re.compile(r'-(\d+)\.html')
+
+def get_listing_id(item):
+    # The carmudi listing number at the end of the URL, e.g. ...-dealer-30246633.html
+    listing = item['item']
+    for key in ['@id', 'sku', 'productID']:
+        if listing.get(key):
+            return str(listing[key])
+
+    # None without any ID or URL, such listings cannot be told apart
+    url = listing.get('url') or listing.get('offers', {}).get('url', '')
+    match = LISTING_ID_PATTERN.search(url)
+    return match.group(1) if match else url or None
+
+def get_listing_price(item):
+    try:
+        return float(item['item']['offers']['price'])
+    except (KeyError, TypeError, ValueError):
+        return float('nan')
+
+class BloomFilter:
+    def __init__(self, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE, bits=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bits if bits is not None else np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+
+    def get_positions(self, value):
+        # Double hashing, k positions out of the two halves of one 128 bits digest
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, value):
+        for position in self.get_positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.get_positions(value))
+
+class ListingIndex:
+    # Listings seen by previous runs with their last price. The Bloom filter answers most lookups of new
+    # listings, only the listings it may have seen are looked up in the sorted ID arrays memory mapped from disk
+    def __init__(self, index_uri, s3_client=None, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE):
+        self.index_uri = index_uri.rstrip("/") # Local directory or s3://bucket/prefix
+        self.s3_client = s3_client
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.local_dir = self.index_uri
+        if self.is_s3():
+            self.local_dir = tempfile.mkdtemp(prefix="listing-index-")
+
+        self.ids = np.array([], dtype=str)
+        self.prices = np.array([], dtype=np.float64)
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.updates = {} # Listings new or repriced in this run
+        self.stats = {'new': 0, 'changed': 0, 'unchanged': 0}
+
+    def is_s3(self):
+        return self.index_uri.startswith("s3://")
+
+    def get_bucket_key(self, name):
+        bucket, prefix = self.index_uri.replace("s3://", "").split("/", 1)
+        return bucket, f"{prefix}/{name}"
+
+    def download(self):
+        for name in INDEX_FILES:
+            bucket, key = self.get_bucket_key(name)
+            try:
+                self.s3_client.download_file(bucket, key, os.path.join(self.local_dir, name))
+            except self.s3_client.exceptions.ClientError as e:
+                if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                    raise
+                return False
+        return True
+
+    def load(self):
+        if self.is_s3() and not self.download():
+            return 0
+        if not all(os.path.exists(os.path.join(self.local_dir, name)) for name in INDEX_FILES):
+            return 0
+
+        self.ids = np.load(os.path.join(self.local_dir, FILE_IDS), mmap_mode='r')
+        self.prices = np.load(os.path.join(self.local_dir, FILE_PRICES), mmap_mode='r')
+        with open(os.path.join(self.local_dir, FILE_BLOOM_META)) as f:
+            meta = json.load(f)
+        self.bloom = BloomFilter(meta['capacity'], meta['error_rate'], np.load(os.path.join(self.local_dir, FILE_BLOOM)))
+        return len(self.ids)
+
+    def get_price(self, listing_id):
+        if listing_id in self.updates:
+            return self.updates[listing_id]
+        if listing_id not in self.bloom:
+            return None
+
+        position = np.searchsorted(self.ids, listing_id)
+        if position < len(self.ids) and self.ids[position] == listing_id:
+            return self.prices[position]
+        return None
+
+    def filter(self, items):
+        # Keep the listings never seen before and the ones whose price changed since they were last seen
+        if items is None:
+            return None
+
+        delta = []
+        for item in items:
+            listing_id = get_listing_id(item)
+            if listing_id is None:
+                # Always kept and never indexed, they would all share one entry
+                self.stats['new'] += 1
+                delta.append(item)
+                continue
+
+            price = get_listing_price(item)
+            known_price = self.get_price(listing_id)
+
+            if known_price is None:
+                self.stats['new'] += 1
+            elif known_price == price or (np.isnan(known_price) and np.isnan(price)):
+                self.stats['unchanged'] += 1
+                continue
+            else:
+                self.stats['changed'] += 1
+
+            self.updates[listing_id] = price
+            self.bloom.add(listing_id)
+            delta.append(item)
+        return delta
+
+    def save(self):
+        # Merge the updates into the sorted arrays, the updated price wins over the indexed one
+        update_ids = np.array(list(self.updates), dtype=str)
+        update_prices = np.array(list(self.updates.values()), dtype=np.float64)
+        keep = ~np.isin(self.ids, update_ids)
+        ids = np.concatenate([np.asarray(self.ids)[keep], update_ids])
+        prices = np.concatenate([np.asarray(self.prices)[keep], update_prices])
+        order = np.argsort(ids, kind='stable')
+        ids, prices = ids[order], prices[order]
+
+        bloom = self.bloom
+        if len(ids) > bloom.capacity:
+            bloom = BloomFilter(max(len(ids) * 2, self.capacity), self.error_rate)
+            for listing_id in ids:
+                bloom.add(str(listing_id))
+
+        # Write into a new directory then swap it in, so a crash never leaves a half written index
+        os.makedirs(self.local_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.local_dir)
+        np.save(os.path.join(tmp_dir, FILE_IDS), ids)
+        np.save(os.path.join(tmp_dir, FILE_PRICES), prices)
+        np.save(os.path.join(tmp_dir, FILE_BLOOM), bloom.bits)
+        with open(os.path.join(tmp_dir, FILE_BLOOM_META), 'w') as f:
+            json.dump({'capacity': bloom.capacity, 'error_rate': bloom.error_rate, 'listings': len(ids)}, f)
+
+        self.ids = self.prices = None # Release the memory maps before their files are replaced
+        for name in INDEX_FILES:
+            os.replace(os.path.join(tmp_dir, name), os.path.join(self.local_dir, name))
+            if self.is_s3():
+                bucket, key = self.get_bucket_key(name)
+                self.s3_client.upload_file(os.path.join(self.local_dir, name), bucket, key)
+        shutil.rmtree(tmp_dir)
+
+        self.ids, self.prices, self.bloom = ids, prices, bloom
+        self.updates = {}
+        return len(ids)
+
+    def save_updates(self, name):
+        # The shards of a run share one index, each of them only writes the listings it saw and
+        # the updates of every shard are merged into the index once they all finished
+        file_name = f"{UPDATES_PREFIX}{name}.json"
+        os.makedirs(self.local_dir, exist_ok=True)
+        with open(os.path.join(self.local_dir, file_name), 'w') as f:
+            json.dump(self.updates, f)
+        if self.is_s3():
+            bucket, key = self.get_bucket_key(file_name)
+            self.s3_client.upload_file(os.path.join(self.local_dir, file_name), bucket, key)
+        return len(self.updates)
+
+    def list_updates(self):
+        if not self.is_s3():
+            return sorted(os.path.basename(path) for path in glob.glob(os.path.join(self.local_dir, f"{UPDATES_PREFIX}*.json")))
+
+        bucket, prefix = self.get_bucket_key(UPDATES_PREFIX)
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        keys = [obj['Key'] for page in paginator.paginate(Bucket=bucket, Prefix=prefix) for obj in page.get('Contents', [])]
+        return sorted(key.rsplit("/", 1)[-1] for key in keys if key.endswith(".json"))
+
+    def merge_updates(self):
+        # Apply the updates of every shard to the index, then remove them so they are never applied twice
+        self.load()
+        file_names = self.list_updates()
+        for file_name in file_names:
+            path = os.path.join(self.local_dir, file_name)
+            if self.is_s3():
+                bucket, key = self.get_bucket_key(file_name)
+                self.s3_client.download_file(bucket, key, path)
+            with open(path) as f:
+                for listing_id, price in json.load(f).items():
+                    self.updates[listing_id] = price
+                    self.bloom.add(listing_id)
+
+        indexed = self.save()
+        for file_name in file_names:
+            os.remove(os.path.join(self.local_dir, file_name))
+            if self.is_s3():
+                bucket, key = self.get_bucket_key(file_name)
+                self.s3_client.delete_object(Bucket=bucket, Key=key)
+        return len(file_names), indexed
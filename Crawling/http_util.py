@@ -0,0 +1,129 @@
+import asyncio
+import io
+import threading
+import time
+
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+USER_AGENT = 'Mozilla/5.0'
+DEFAULT_TIMEOUT = 30
+DEFAULT_POOL_SIZE = 8 # Keep-alive connections kept open for each host
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate # Tokens added per second
+        self.capacity = capacity # Maximum burst size
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # Take one token (possibly going into debt) and return how long the caller must wait for it
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class HostRateLimiter:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def get_bucket(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.capacity)
+            return self.buckets[host]
+
+    def acquire(self, url):
+        self.get_bucket(url).acquire()
+
+    async def acquire_async(self, url):
+        await self.get_bucket(url).acquire_async()
+
+class HttpSession:
+    # Connection pool shared by every request of a crawl, connections are kept alive between requests
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, http2=False):
+        import urllib3
+        from urllib3.util import make_headers
+
+        if http2:
+            # Experimental in urllib3 2.x and needs the 'h2' package, so it stays opt-in
+            import urllib3.http2
+            urllib3.http2.inject_into_urllib3()
+
+        self.urllib3 = urllib3
+        # Redirects are followed, every other retry is left to the crawler throttle
+        retries = urllib3.Retry(total=None, connect=0, read=0, status=0, other=0, redirect=5)
+        self.pool = urllib3.PoolManager(maxsize=pool_size, block=True, retries=retries, timeout=timeout)
+        # gzip/deflate always, br and zstd when the brotli/zstandard packages are installed
+        self.headers = make_headers(accept_encoding=True)
+
+    def get(self, url, headers):
+        # Errors are raised as urllib ones, so callers handle both code paths the same way
+        try:
+            response = self.pool.request('GET', url, headers={**self.headers, **headers})
+        except self.urllib3.exceptions.HTTPError as e:
+            raise URLError(e) from e
+
+        if response.status >= 300:
+            raise HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(response.data))
+        return response.data, response.headers
+
+def get_cached_page(url, cache):
+    # Body of a fresh cache entry, None when the page has to be requested. Crawlers look it up before waiting
+    # for the rate limiter, so a cached page costs neither a token nor a request slot
+    meta = cache.get(url)
+    if meta is not None and cache.is_fresh(meta):
+        return cache.read_body(url)
+    return None
+
+def fetch_page(url, timeout=DEFAULT_TIMEOUT, cache=None, session=None):
+    headers = {'User-Agent': USER_AGENT}
+
+    meta = cache.get(url) if cache is not None else None
+    if meta is not None:
+        if cache.is_fresh(meta):
+            return cache.read_body(url)
+
+        # Stale entry, ask the server whether it changed since
+        if meta['etag']:
+            headers['If-None-Match'] = meta['etag']
+        if meta['last_modified']:
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        if session is not None:
+            body, response_headers = session.get(url, headers)
+        else:
+            with urlopen(Request(url, headers=headers), timeout=timeout) as response:
+                body, response_headers = response.read(), response.headers
+    except HTTPError as e:
+        if e.code == 304 and meta is not None:
+            cache.refresh(url, meta)
+            return cache.read_body(url)
+        raise
+
+    if cache is not None:
+        cache.put(url, body, response_headers)
+    return body
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import re
+import time
+
+# Manifests live outside of the prefixes they describe, so writing one never fires the S3 triggers
+# of the prefix nor shows up in its listing
+MANIFEST_ROOT = "_latest"
+# Partitions named by the write date, e.g. training/toyota/crawling/20240131/, sort in the order they were written
+DATE_PARTITION_PATTERN = re.compile(r"^\d{8}(?:-[\d:]+)?/")
+
+def get_manifest_key(prefix):
+    return f"{MANIFEST_ROOT}/{prefix.strip('/')}.json"
+
+def is_candidate(key, suffixes):
+    return not key.endswith("/") and (suffixes is None or key.endswith(tuple(suffixes)))
+
+def read_manifest(s3_client, bucket, prefix):
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=get_manifest_key(prefix))['Body'].read()
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(body)
+
+def update_latest(s3_client, bucket, key, prefix, last_modified=None):
+    # Called by every writer of the prefix right after its upload, so readers resolve the newest object in O(1).
+    # The time is the LastModified of the object in S3, the one get_latest_file compares with the listing
+    if last_modified is None:
+        last_modified = s3_client.head_object(Bucket=bucket, Key=key)['LastModified'].timestamp()
+    manifest = {
+        'key': key,
+        'last_modified': last_modified,
+        'updated_at': time.time()
+    }
+    s3_client.put_object(Bucket=bucket, Key=get_manifest_key(prefix), Body=json.dumps(manifest).encode('utf-8'))
+    return manifest
+
+def get_start_after(key, prefix):
+    # Objects written after the manifest key of a date partitioned prefix are in its partition or a later one, so
+    # the listing can start at that partition. Elsewhere, e.g. lelang files named freely, a newer object may sort
+    # anywhere and the whole prefix is listed
+    relative = key[len(prefix):].lstrip("/") if key.startswith(prefix) else ""
+    match = DATE_PARTITION_PATTERN.match(relative)
+    if match is None:
+        return None
+    return key[:len(key) - len(relative)] + match.group(0).rstrip("/")
+
+def iter_objects(s3_client, bucket, prefix, start_after=None):
+    # Every page of the listing, list_objects_v2 alone stops at 1000 keys
+    params = {'Bucket': bucket, 'Prefix': prefix}
+    if start_after:
+        params['StartAfter'] = start_after
+    for page in s3_client.get_paginator("list_objects_v2").paginate(**params):
+        yield from page.get("Contents", [])
+
+def get_latest_file(s3_client, bucket_name, prefix_name, suffixes=None, update=True):
+    manifest = read_manifest(s3_client, bucket_name, prefix_name)
+    if manifest is not None and not is_candidate(manifest['key'], suffixes):
+        manifest = None
+
+    latest_key = manifest['key'] if manifest else None
+    latest_time = manifest['last_modified'] if manifest else None
+
+    # With the manifest of a date partitioned prefix only its partition and the later ones are listed, to catch
+    # an object of a writer that did not update it. Otherwise the whole prefix is listed
+    start_after = get_start_after(latest_key, prefix_name) if latest_key else None
+    for obj in iter_objects(s3_client, bucket_name, prefix_name, start_after=start_after):
+        if not is_candidate(obj["Key"], suffixes):
+            continue
+        last_modified = obj["LastModified"].timestamp()
+        if latest_time is None or last_modified > latest_time:
+            latest_key, latest_time = obj["Key"], last_modified
+
+    if latest_key is None:
+        raise FileNotFoundError(f"No file found at s3://{bucket_name}/{prefix_name}")
+
+    if update and (manifest is None or manifest['key'] != latest_key):
+        try:
+            update_latest(s3_client, bucket_name, latest_key, prefix_name, latest_time)
+        except s3_client.exceptions.ClientError:
+            pass # Read only callers still get the answer, the next writer updates the manifest
+    return f"s3://{bucket_name}/{latest_key}"
+
+def get_input_fingerprint(s3_client, s3_uris):
+    # Changes whenever one of the objects is uploaded again, even under the same key
+    digest = hashlib.sha256()
+    for s3_uri in s3_uris:
+        bucket, key = s3_uri.replace("s3://", "").split("/", 1)
+        digest.update(s3_client.head_object(Bucket=bucket, Key=key)['ETag'].encode('utf-8'))
+    return digest.hexdigest()[:16]
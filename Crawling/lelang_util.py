@@ -0,0 +1,87 @@
+import hashlib
+import io
+import os
+
+import pandas as pd
+
+COL_TYPE = 'Type'
+COL_TAHUN = 'tahun'
+LELANG_COLUMNS = [COL_TYPE, COL_TAHUN] # The only columns the crawler reads
+CSV_SEP = ";"
+
+def is_s3(path):
+    return path.startswith("s3://")
+
+def get_bucket_key(path):
+    bucket, key = path.replace("s3://", "").split("/", 1)
+    return bucket, key
+
+def get_source_version(path, s3_client=None):
+    # The ETag changes with every upload of the object, a local file is identified by its size and mtime
+    if is_s3(path):
+        bucket, key = get_bucket_key(path)
+        return s3_client.head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+def get_cache_path(cache_uri, path, version):
+    name = hashlib.sha256(path.encode('utf-8')).hexdigest()[:16]
+    return f"{cache_uri.rstrip('/')}/{name}-{version}.parquet"
+
+def read_source(path, s3_client=None):
+    if is_s3(path):
+        bucket, key = get_bucket_key(path)
+        source = io.BytesIO(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+    else:
+        source = path
+
+    if path.endswith(".csv"):
+        df = pd.read_csv(source, sep=CSV_SEP, usecols=LELANG_COLUMNS, dtype={COL_TYPE: str})
+    elif path.endswith(".xlsx"):
+        df = pd.read_excel(source, usecols=LELANG_COLUMNS, dtype={COL_TYPE: str})
+    else:
+        raise ValueError(f"File extension of {path} is not supported! File extension must be .csv or .xlsx.")
+
+    # Explicit dtypes, so every conversion of a lelang file gets the same Parquet schema
+    df[COL_TYPE] = df[COL_TYPE].astype('string')
+    df[COL_TAHUN] = pd.to_numeric(df[COL_TAHUN], errors='coerce').astype('Int16')
+    return df[LELANG_COLUMNS]
+
+def read_cache(cache_path, s3_client=None):
+    if is_s3(cache_path):
+        bucket, key = get_bucket_key(cache_path)
+        try:
+            body = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except s3_client.exceptions.NoSuchKey:
+            return None
+        return pd.read_parquet(io.BytesIO(body), columns=LELANG_COLUMNS)
+
+    if not os.path.exists(cache_path):
+        return None
+    return pd.read_parquet(cache_path, columns=LELANG_COLUMNS)
+
+def write_cache(df, cache_path, s3_client=None):
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    if is_s3(cache_path):
+        bucket, key = get_bucket_key(cache_path)
+        s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+    else:
+        # Write next to the target then rename, so a crash never leaves a half written copy
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, cache_path)
+
+def load_lelang(path, cache_uri=None, s3_client=None):
+    # Each upload of a lelang file is parsed once, the next runs read its Parquet copy
+    if cache_uri is None:
+        return read_source(path, s3_client)
+
+    cache_path = get_cache_path(cache_uri, path, get_source_version(path, s3_client))
+    df = read_cache(cache_path, s3_client)
+    if df is None:
+        df = read_source(path, s3_client)
+        write_cache(df, cache_path, s3_client)
+    return df
@@ -0,0 +1,146 @@
+import os
+import uuid
+
+from time import gmtime, strftime
+
+PART_SIZE = 8 * 1024 * 1024 # S3 requires at least 5 MB for every part except the last one
+DEFAULT_BATCH_ROWS = 5000 # Rows buffered by a writer across its partitions before they are flushed as row groups
+
+class S3MultipartWriter:
+    # File-like object streaming everything written to it into one S3 object
+    def __init__(self, s3_client, bucket, key, part_size=PART_SIZE):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts = []
+        self.position = 0
+        self.closed = False
+        self.upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self.buffer.extend(data)
+        self.position += len(data)
+        if len(self.buffer) >= self.part_size:
+            self.upload_part()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def upload_part(self):
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=bytes(self.buffer)
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.buffer = bytearray()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.buffer or not self.parts:
+                self.upload_part()
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': self.parts}
+            )
+        except Exception:
+            self.abort()
+            raise
+
+    def abort(self):
+        self.closed = True
+        self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+class ParquetPartitionWriter:
+    # Writes crawl results as Hive style partitions: brand=/variant=/tahun=/crawl_date=/part-<run>.parquet
+    def __init__(self, output_uri, brand, variant, s3_client=None, batch_rows=DEFAULT_BATCH_ROWS,
+                 col_tahun='tahun', crawl_date=None):
+        import pyarrow as pa
+
+        self.output_uri = output_uri.rstrip("/") # Local directory or s3://bucket/prefix
+        self.brand = brand
+        self.variant = variant
+        self.s3_client = s3_client
+        self.batch_rows = batch_rows
+        self.col_tahun = col_tahun
+        self.crawl_date = crawl_date or strftime("%Y%m%d", gmtime())
+
+        # A resumed run writes new part files next to the ones of the failed run
+        self.run_id = f"{strftime('%H%M%S', gmtime())}-{uuid.uuid4().hex[:8]}"
+        self.schema = pa.schema([
+            ('price', pa.float64()),
+            ('cc', pa.string()),
+            ('Type', pa.string()),
+            ('transmisi', pa.string()),
+            ('listing_id', pa.string()) # Null for a listing without any ID or URL
+        ])
+        self.writers = {}
+        self.buffers = {}
+        self.buffered_rows = 0
+        self.rows_written = 0
+
+    def get_partition_path(self, tahun):
+        return f"{self.output_uri}/brand={self.brand}/variant={self.variant}/{self.col_tahun}={tahun}/crawl_date={self.crawl_date}/part-{self.run_id}.parquet"
+
+    def open_writer(self, tahun):
+        import pyarrow.parquet as pq
+
+        path = self.get_partition_path(tahun)
+        if path.startswith("s3://"):
+            bucket, key = path.replace("s3://", "").split("/", 1)
+            sink = S3MultipartWriter(self.s3_client, bucket, key)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            sink = path
+        return pq.ParquetWriter(sink, self.schema), sink
+
+    def write(self, df):
+        for tahun, df_partition in df.groupby(self.col_tahun, sort=False):
+            tahun = int(tahun)
+            self.buffers.setdefault(tahun, []).append(df_partition.drop(columns=[self.col_tahun]))
+            self.buffered_rows += len(df_partition)
+
+        # Bounded for the whole writer, not per tahun, a crawl spreads its rows over many years
+        if self.buffered_rows >= self.batch_rows:
+            for tahun in list(self.buffers):
+                self.flush(tahun)
+
+    def flush(self, tahun):
+        import pandas as pd
+        import pyarrow as pa
+
+        df_buffer = pd.concat(self.buffers.pop(tahun, []), ignore_index=True)
+        self.buffered_rows -= len(df_buffer)
+        if df_buffer.empty:
+            return
+
+        df_buffer['price'] = pd.to_numeric(df_buffer['price'], errors='coerce')
+        df_buffer[['cc', 'Type', 'transmisi']] = df_buffer[['cc', 'Type', 'transmisi']].astype(str)
+        if tahun not in self.writers:
+            self.writers[tahun] = self.open_writer(tahun)
+
+        # Every flush becomes one row group, so memory stays bounded by the batch size
+        writer, _ = self.writers[tahun]
+        writer.write_table(pa.Table.from_pandas(df_buffer, schema=self.schema, preserve_index=False))
+        self.rows_written += len(df_buffer)
+
+    def close(self):
+        for tahun in list(self.buffers):
+            self.flush(tahun)
+        for writer, sink in self.writers.values():
+            writer.close()
+            if isinstance(sink, S3MultipartWriter):
+                sink.close()
+        self.writers = {}
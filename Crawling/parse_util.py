@@ -0,0 +1,77 @@
+import json
+import math
+import re
+
+EXTRACTOR_REGEX = 'regex'
+EXTRACTOR_LXML = 'lxml'
+EXTRACTOR_BS4 = 'bs4'
+
+# Fastest first, an extractor falls back to the ones after it when it fails
+EXTRACTORS_ORDER = [EXTRACTOR_REGEX, EXTRACTOR_LXML, EXTRACTOR_BS4]
+DEFAULT_EXTRACTOR = EXTRACTOR_REGEX
+
+LD_JSON_PATTERN = re.compile(
+    r'<script\b[^>]*\btype\s*=\s*["\']?application/ld\+json["\']?[^>]*>(.*?)</script\s*>',
+    re.IGNORECASE | re.DOTALL
+)
+
+def extract_ld_json_regex(html):
+    return LD_JSON_PATTERN.findall(html)
+
+def extract_ld_json_lxml(html):
+    from lxml import html as lxml_html
+
+    tree = lxml_html.fromstring(html)
+    return [script.text or '' for script in tree.xpath('//script[@type="application/ld+json"]')]
+
+def extract_ld_json_bs4(html):
+    from bs4 import BeautifulSoup
+
+    data = BeautifulSoup(html, 'html.parser')
+    return [script.text for script in data.find_all('script', {'type': 'application/ld+json'})]
+
+EXTRACTORS = {
+    EXTRACTOR_REGEX: extract_ld_json_regex,
+    EXTRACTOR_LXML: extract_ld_json_lxml,
+    EXTRACTOR_BS4: extract_ld_json_bs4
+}
+
+def get_extractor_chain(extractor):
+    return EXTRACTORS_ORDER[EXTRACTORS_ORDER.index(extractor):]
+
+def load_ld_json(html, extractor=DEFAULT_EXTRACTOR):
+    if isinstance(html, bytes):
+        html = html.decode('utf-8', errors='replace')
+
+    # Fall back to a slower extractor when no block is found or a block is not valid JSON,
+    # an ImportError means the optional parser library is not installed
+    for name in get_extractor_chain(extractor):
+        try:
+            blocks = [json.loads(text) for text in EXTRACTORS[name](html)]
+        except (ImportError, ValueError):
+            continue
+
+        if blocks:
+            return blocks
+    return []
+
+def get_page_count(item_list, html):
+    # Prefer the total number of listings, fall back to the highest page linked from the page
+    page_count = 1
+    items_per_page = len(item_list['itemListElement'])
+    number_of_items = item_list.get('numberOfItems')
+    if number_of_items and items_per_page:
+        page_count = math.ceil(int(number_of_items) / items_per_page)
+
+    linked_pages = [int(page) for page in re.findall(r'(?:[?&]|&amp;)page=(\d+)', html)]
+    return max([page_count] + linked_pages)
+
+def parse_listing_page(html, extractor=DEFAULT_EXTRACTOR):
+    if isinstance(html, bytes):
+        html = html.decode('utf-8', errors='replace')
+
+    for script_ in load_ld_json(html, extractor):
+        # Check if crawling result exist
+        if isinstance(script_, list) and len(script_) > 0 and 'itemListElement' in script_[0]:
+            return script_[0]['itemListElement'], get_page_count(script_[0], html)
+    return None, 1
@@ -0,0 +1,104 @@
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+
+# Written on every instance of a SageMaker Processing job
+RESOURCE_CONFIG_PATH = "/opt/ml/config/resourceconfig.json"
+SHARD_PLAN_PATTERN = "shard-*.json"
+
+def get_shard_index(key, num_shards):
+    # Stable across processes and runs, unlike hash() which is salted per process
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % num_shards
+
+def assign_shards(queries, get_key, num_shards):
+    # The shard of a query only depends on its key and the number of shards, so a query stays on the same
+    # shard when other queries are added or removed between runs
+    shards = [[] for _ in range(num_shards)]
+    for query in sorted(queries, key=get_key):
+        shards[get_shard_index(get_key(query), num_shards)].append(query)
+    return shards
+
+def get_shard_name(shard_indexes, num_shards):
+    return f"shard-{'_'.join(f'{index:05d}' for index in sorted(shard_indexes))}-of-{num_shards:05d}"
+
+def get_shard_path(path, shard_name):
+    # data/checkpoint.json -> data/checkpoint-shard-00001-of-00004.json
+    root, ext = os.path.splitext(path)
+    return f"{root}-{shard_name}{ext}"
+
+def get_sagemaker_shard(config_path=RESOURCE_CONFIG_PATH):
+    # Index of the current instance among the instances of the job, None outside of SageMaker
+    if not os.path.exists(config_path):
+        return None
+    with open(config_path) as f:
+        config = json.load(f)
+    hosts = sorted(config['hosts'])
+    return hosts.index(config['current_host']), len(hosts)
+
+def write_shard_plans(shards, get_key, output_uri, s3_client=None):
+    # One file per shard, a ProcessingInput with s3_data_distribution_type='ShardedByS3Key' and as many
+    # instances as shards then gives every instance exactly one of them
+    output_uri = output_uri.rstrip("/")
+    paths = []
+    for index, queries in enumerate(shards):
+        body = json.dumps({
+            'shard_index': index,
+            'num_shards': len(shards),
+            'queries': [get_key(query) for query in queries]
+        }).encode('utf-8')
+
+        path = f"{output_uri}/{get_shard_name([index], len(shards))}.json"
+        if path.startswith("s3://"):
+            bucket, key = path.replace("s3://", "").split("/", 1)
+            s3_client.put_object(Bucket=bucket, Key=key, Body=body)
+        else:
+            os.makedirs(output_uri, exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(body)
+        paths.append(path)
+    return paths
+
+def read_shard_plans(plan_dir):
+    # An instance gets several plan files when there are more shards than instances
+    shard_indexes = []
+    num_shards = None
+    keys = set()
+    for path in sorted(glob.glob(os.path.join(plan_dir, SHARD_PLAN_PATTERN))):
+        with open(path) as f:
+            plan = json.load(f)
+        shard_indexes.append(plan['shard_index'])
+        num_shards = plan['num_shards']
+        keys.update(plan['queries'])
+
+    if not shard_indexes:
+        raise FileNotFoundError(f"No shard plan found in {plan_dir}")
+    return shard_indexes, num_shards, keys
+
+def run_shard_processes(run_shard, num_shards):
+    # Forked processes inherit 'run_shard' as is, so it does not have to be picklable,
+    # only the results travel back through the queue
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+
+    def target(index):
+        try:
+            results.put((index, run_shard(index), None))
+        except Exception as e:
+            results.put((index, None, f"{type(e).__name__}: {e}"))
+
+    processes = [context.Process(target=target, args=(index,)) for index in range(num_shards)]
+    for process in processes:
+        process.start()
+
+    # Read every result before joining, a child blocks on exit until its result is consumed
+    outputs = dict((index, (output, error)) for index, output, error in (results.get() for _ in processes))
+    for process in processes:
+        process.join()
+
+    errors = [f"shard {index}: {error}" for index, (_, error) in sorted(outputs.items()) if error]
+    if errors:
+        raise RuntimeError(f"{len(errors)} of {num_shards} shards failed, " + "; ".join(errors))
+    return [outputs[index][0] for index in range(num_shards)]
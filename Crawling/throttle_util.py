@@ -0,0 +1,166 @@
+import asyncio
+import http.client
+import logging
+import random
+import time
+
+from collections import deque
+from email.utils import parsedate_to_datetime
+from urllib.error import HTTPError, URLError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INITIAL_CONCURRENCY = 2
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 1.0 # Seconds, doubled on every retry
+DEFAULT_BACKOFF_CAP = 60.0
+DEFAULT_BREAKER_WINDOW = 20 # Number of recent requests the error rate is computed on
+DEFAULT_BREAKER_THRESHOLD = 0.5
+DEFAULT_BREAKER_COOLDOWN = 30.0
+DECREASE_FACTOR = 0.5
+
+def is_retryable(error):
+    if isinstance(error, HTTPError):
+        return error.code == 429 or error.code >= 500
+    return isinstance(error, (URLError, TimeoutError, ConnectionError, http.client.HTTPException))
+
+def get_retry_after(error):
+    # Retry-After is either a number of seconds or an HTTP date
+    value = error.headers.get('Retry-After') if isinstance(error, HTTPError) and error.headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class AdaptiveThrottle:
+    # AIMD concurrency limit, jittered exponential retries and a circuit breaker for one crawl
+    def __init__(self, max_limit, initial_limit=DEFAULT_INITIAL_CONCURRENCY, min_limit=1, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_base=DEFAULT_BACKOFF_BASE, backoff_cap=DEFAULT_BACKOFF_CAP, breaker_window=DEFAULT_BREAKER_WINDOW,
+                 breaker_threshold=DEFAULT_BREAKER_THRESHOLD, breaker_cooldown=DEFAULT_BREAKER_COOLDOWN):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+
+        self.outcomes = deque(maxlen=breaker_window)
+        self.successes = 0
+        self.in_flight = 0
+        self.condition = None
+        self.resume_at = 0.0 # Set by an open circuit or a Retry-After header
+        self.retries = 0
+        self.failures = 0 # Requests given up on, the caller decides whether the crawl goes on
+
+    def get_wait(self):
+        return max(0.0, self.resume_at - time.monotonic())
+
+    def get_backoff(self, attempt):
+        # Full jitter keeps the retries of concurrent requests apart
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def on_success(self):
+        self.outcomes.append(True)
+
+        # Additive increase, one more slot after a full window of successes at the current limit
+        self.successes += 1
+        if self.successes >= int(self.limit):
+            self.limit = min(self.max_limit, self.limit + 1)
+            self.successes = 0
+
+    def on_failure(self, error, attempt):
+        self.outcomes.append(False)
+        self.retries += 1
+
+        # Multiplicative decrease
+        self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+        self.successes = 0
+
+        delay = get_retry_after(error)
+        if delay is not None:
+            self.resume_at = max(self.resume_at, time.monotonic() + delay)
+        else:
+            delay = self.get_backoff(attempt)
+
+        failures = self.outcomes.count(False)
+        if len(self.outcomes) == self.outcomes.maxlen and failures / len(self.outcomes) >= self.breaker_threshold:
+            logger.warning(f"Circuit opened after {failures} failures in the last {len(self.outcomes)} requests, "
+                           f"pausing for {self.breaker_cooldown:.0f} seconds")
+            self.resume_at = max(self.resume_at, time.monotonic() + self.breaker_cooldown)
+            self.outcomes.clear()
+
+        logger.info(f"Retrying after {type(error).__name__}: {error} (attempt {attempt + 1}, concurrency {int(self.limit)})")
+        return delay
+
+    def on_error(self, error):
+        # Not retryable, e.g. a 404 or 410 for a page that is gone, but it still counts for the circuit breaker
+        self.outcomes.append(False)
+        self.failures += 1
+        logger.warning(f"Giving up after {type(error).__name__}: {error}")
+
+    def call(self, fn, *args):
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self.get_wait())
+            try:
+                result = fn(*args)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.on_error(e)
+                    raise
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.on_failure(e, attempt))
+            else:
+                self.on_success()
+                return result
+
+    async def acquire_async(self):
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+
+        while True:
+            # Pauses are waited out without holding the lock, so finished requests can still release their slot
+            wait = self.get_wait()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            async with self.condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                await self.condition.wait()
+
+    async def release_async(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    async def call_async(self, run, *args):
+        # 'run' is a coroutine function, e.g. running a blocking fetch in an executor
+        for attempt in range(self.max_retries + 1):
+            await self.acquire_async()
+            try:
+                result = await run(*args)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.on_error(e)
+                    raise
+                if attempt == self.max_retries:
+                    raise
+                delay = self.on_failure(e, attempt)
+            else:
+                self.on_success()
+                return result
+            finally:
+                await self.release_async()
+
+            await asyncio.sleep(delay)
@@ -1,4 +1,5 @@
 import boto3
+from latest_util import get_latest_file, update_latest
 from logger_util import logger
 
 '''
@@ -16,13 +17,6 @@ sagemaker_virginia = boto3.client('sagemaker', region_name='us-east-1')
 s3_singapore = boto3.client("s3", region_name="ap-southeast-1")
 
 def run_pipeline(pipeline_name, s3_path, model_type):
-    def get_latest_file(bucket_name, prefix_name):
-        s3_uri_response = s3_singapore.list_objects_v2(Bucket=bucket_name, Prefix=prefix_name)
-        csv_keys = [obj for obj in s3_uri_response.get("Contents", []) if obj["Key"].endswith(".csv")]
-        latest_csv_key = sorted(csv_keys, key=lambda x: x["LastModified"], reverse=True)[0]["Key"]
-        
-        return f"s3://{bucket_name}/{latest_csv_key}"
-    
     def get_latest_model():
         model_response = sagemaker_virginia.list_models(
             SortBy='CreationTime',
@@ -40,9 +34,17 @@ def run_pipeline(pipeline_name, s3_path, model_type):
     prefix = key.split("/", 1)[0]
     
     s3_uri_lelang = s3_path
+    # The upload that triggered this function is the latest lelang file of its prefix
+    try:
+        update_latest(s3_singapore, bucket, key, key.rsplit("/", 1)[0])
+    except s3_singapore.exceptions.ClientError as e:
+        # Without s3:PutObject on _latest/ the pipeline still starts, the readers then list the prefix
+        logger.warning(f'Could not update the latest lelang manifest of "{s3_uri_lelang}": {e}')
     s3_uri_crawling = get_latest_file(
+        s3_singapore,
         bucket,
-        f'{prefix}/training/{model_type}/crawling'
+        f'{prefix}/training/{model_type}/crawling',
+        suffixes=[".csv"]
     )
     
     model_name = get_latest_model()[1]
@@ -1,4 +1,5 @@
 import boto3
+from latest_util import get_input_fingerprint, get_latest_file, update_latest
 from logger_util import logger
 
 '''
@@ -18,13 +19,6 @@ sagemaker_virginia = boto3.client('sagemaker', region_name='us-east-1')
 s3_singapore = boto3.client("s3", region_name="ap-southeast-1")
     
 def run_pipeline(pipeline_name, s3_path, model_type):
-    def get_latest_file(bucket_name, prefix_name):
-        s3_uri_response = s3_singapore.list_objects_v2(Bucket=bucket_name, Prefix=prefix_name)
-        csv_keys = [obj for obj in s3_uri_response.get("Contents", []) if obj["Key"].endswith(".csv")]
-        latest_csv_key = sorted(csv_keys, key=lambda x: x["LastModified"], reverse=True)[0]["Key"]
-        
-        return f"s3://{bucket_name}/{latest_csv_key}"
-    
     def get_best_hyperparameter(model_type):
         hpo_response = sagemaker_virginia.list_hyper_parameter_tuning_jobs(
             SortBy='CreationTime',
@@ -45,11 +39,20 @@ def run_pipeline(pipeline_name, s3_path, model_type):
     prefix = key.rsplit("/", 3)[0]
     
     s3_uri_lelang = s3_path
-    s3_uri_crawling = get_latest_file(bucket, '/'.join([prefix, "crawling"]))
+    # The upload that triggered this function is the latest lelang file of its prefix
+    try:
+        update_latest(s3_singapore, bucket, key, key.rsplit("/", 1)[0])
+    except s3_singapore.exceptions.ClientError as e:
+        # Without s3:PutObject on _latest/ the pipeline still starts, the readers then list the prefix
+        logger.warning(f'Could not update the latest lelang manifest of "{s3_uri_lelang}": {e}')
+    s3_uri_crawling = get_latest_file(s3_singapore, bucket, '/'.join([prefix, "crawling"]), suffixes=[".csv"])
     
     logger.info(f'The latest {model_type.capitalize()} file for lelang data is located at "{s3_uri_lelang}"')
     logger.info(f'The latest {model_type.capitalize()} file for crawling data is located at "{s3_uri_crawling}"')
 
+    # The Preprocess step is reused from the cache when neither file changed since a previous execution
+    input_fingerprint = get_input_fingerprint(s3_singapore, [s3_uri_lelang, s3_uri_crawling])
+
     # Start the pipeline execution with defined parameters
     execution_response = sagemaker_virginia.start_pipeline_execution(
         PipelineName=pipeline_name,
@@ -78,6 +81,10 @@ def run_pipeline(pipeline_name, s3_path, model_type):
                  "Name": "InputDataCrawlingURI",
                  "Value": s3_uri_crawling
             },
+            { 
+                 "Name": "InputFingerprint",
+                 "Value": input_fingerprint
+            },
             { 
                  "Name": "MaxDepth",
                  "Value": hyperparameters['max_depth']
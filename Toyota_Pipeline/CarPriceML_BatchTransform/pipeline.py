@@ -22,11 +22,13 @@ PREFIX_MODEL = "glair-bcaf-consultation-output/model"
 PREFIX_EVALUATION = "glair-bcaf-consultation-output/evaluation"
 PREFIX_BATCH_TRANSFORM = "glair-bcaf-consultation-output/batch-transform"
 MODEL_TYPE = "toyota"
+FEATURE_CACHE_PREFIX = "glair-bcaf-consultation-output/feature-cache" # Features shared by the Training, HPO and BatchTransform pipelines, None to disable
 '''
 Edit above section only according to your needs!
 '''
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+COMMON_DIR = os.path.join(BASE_DIR, "..", "CarPriceML_Common") # Modules shared by the processing scripts of every pipeline
 
 def get_sagemaker_session(region, default_bucket):
     boto_session = boto3.Session(region_name=region)
@@ -105,6 +107,13 @@ def get_pipeline(
         },
     ]
     
+    # Shared modules, placed next to the script directory /opt/ml/processing/input/code
+    common_input = ProcessingInput(
+        source=COMMON_DIR,
+        destination="/opt/ml/processing/input/CarPriceML_Common",
+        input_name="common"
+    )
+
     # Processing step
     sklearn_processor = SKLearnProcessor(
         framework_version="0.23-1",
@@ -116,12 +125,15 @@ def get_pipeline(
     )
 
     step_args = sklearn_processor.run(
+        inputs=[common_input],
         outputs=[
             ProcessingOutput(output_name="predict", source="/opt/ml/processing/predict")
         ],
         code=os.path.join(BASE_DIR, "preprocess.py"),
         arguments=["--input-data-lelang", input_data_lelang,
-                   "--input-data-crawling", input_data_crawling]
+                   "--input-data-crawling", input_data_crawling,
+                   "--model-type", MODEL_TYPE]
+                  + (["--feature-cache-uri", f"s3://{DEFAULT_BUCKET}/{FEATURE_CACHE_PREFIX}"] if FEATURE_CACHE_PREFIX else [])
     )
 
     step_preprocess = ProcessingStep(
@@ -175,6 +187,7 @@ def get_pipeline(
 
     # Postprocessing step
     step_args = sklearn_processor.run(
+        inputs=[common_input],
         code=os.path.join(BASE_DIR, "postprocess.py"),
         arguments=["--input-data-lelang", input_data_lelang,
                    "--input-data-crawling", input_data_crawling,
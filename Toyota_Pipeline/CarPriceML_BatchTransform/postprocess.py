@@ -3,15 +3,22 @@ import argparse
 import logging
 import os
 import pathlib
+import sys
 import boto3
 import pandas as pd
 
+from functools import partial
 from time import gmtime, strftime
 
 '''
 Add your required additional dependencies here!
 '''
 
+# Shared modules, shipped next to the script in the processing container
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "CarPriceML_Common"))
+from stream_util import read_csv
+from transfer_util import run_transfers, upload_file
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
@@ -28,7 +35,6 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     base_dir = "/opt/ml/processing"
-    pathlib.Path(f"{base_dir}/raw").mkdir(parents=True, exist_ok=True)
     pathlib.Path(f"{base_dir}/batch_transform").mkdir(parents=True, exist_ok=True)
     input_data_lelang = args.input_data_lelang
     input_data_crawling = args.input_data_crawling
@@ -51,29 +57,18 @@ if __name__ == "__main__":
     s3_singapore = boto3.resource("s3", region_name="ap-southeast-1")
     s3_virginia = boto3.resource("s3", region_name="us-east-1")
     
-    logger.info("Downloading lelang data from <%s/%s>...", bucket_lelang, key_lelang)
-    lelang_path = f"{base_dir}/raw/lelang.csv"
-    s3_singapore.Bucket(bucket_lelang).download_file(key_lelang, lelang_path)
-    
-    logger.info("Downloading crawling data from <%s/%s>...", bucket_crawling, key_crawling)
-    crawling_path = f"{base_dir}/raw/crawling.csv"
-    s3_singapore.Bucket(bucket_crawling).download_file(key_crawling, crawling_path)
-    
-    logger.info("Downloading batch transform data from <%s/%s>...", bucket_batch, key_batch)
-    batch_path = f"{base_dir}/raw/batch_transform.csv"
-    s3_virginia.Bucket(bucket_batch).download_file(key_batch, batch_path)
-
-    logger.info("Reading lelang data...")
-    df_lelang = pd.read_csv(lelang_path)
-    os.unlink(lelang_path)
-    
-    logger.info("Reading crawling data...")
-    df_crawling = pd.read_csv(crawling_path)
-    os.unlink(crawling_path)
-    
-    logger.info("Reading batch transform data...")
-    df_batch = pd.read_csv(batch_path, header=None, names=['prediksi'])
-    os.unlink(batch_path)
+    # Parsed while streaming from S3, without a copy on disk, all inputs at the same time
+    logger.info("Reading lelang data from <%s/%s>...", bucket_lelang, key_lelang)
+    logger.info("Reading crawling data from <%s/%s>...", bucket_crawling, key_crawling)
+    logger.info("Reading batch transform data from <%s/%s>...", bucket_batch, key_batch)
+    inputs = run_transfers({
+        "lelang": partial(read_csv, input_data_lelang, s3_singapore.meta.client),
+        "crawling": partial(read_csv, input_data_crawling, s3_singapore.meta.client),
+        "batch transform": partial(read_csv, f"s3://{bucket_batch}/{key_batch}", s3_virginia.meta.client, header=None, names=['prediksi'])
+    })
+    df_lelang = inputs["lelang"]
+    df_crawling = inputs["crawling"]
+    df_batch = inputs["batch transform"]
     
     '''
     Add your own postprocessing step here!
@@ -95,4 +90,4 @@ if __name__ == "__main__":
     
     # Upload the data to S3
     logger.info("Writing out datasets to <%s>...", bucket_batch)
-    s3_virginia.meta.client.upload_file(f"{base_dir}/batch_transform/batch_transform.csv", Bucket=bucket_batch, Key=f"{prefix_batch_transform}/{model_type}/with_header/{unique_key}/{name_file_send}.csv")
\ No newline at end of file
+    upload_file(s3_virginia.meta.client, f"{base_dir}/batch_transform/batch_transform.csv", bucket_batch, f"{prefix_batch_transform}/{model_type}/with_header/{unique_key}/{name_file_send}.csv")
\ No newline at end of file
@@ -2,10 +2,10 @@
 import argparse
 import logging
 import os
-import pathlib
+import sys
 import boto3
-import pandas as pd
 
+from functools import partial
 from time import gmtime, strftime
 from sklearn.model_selection import train_test_split
 
@@ -13,6 +13,13 @@ from sklearn.model_selection import train_test_split
 Add your required additional dependencies here!
 '''
 
+# Shared modules, shipped next to the script in the processing container
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "CarPriceML_Common"))
+from feature_cache_util import load_market_index
+from market_util import add_market_features
+from stream_util import ensure_parquet_engine, read_csv
+from transfer_util import run_transfers
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
@@ -22,12 +29,18 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input-data-lelang", type=str, required=True)
     parser.add_argument("--input-data-crawling", type=str, required=True)
+    parser.add_argument("--model-type", type=str, required=True)
+    parser.add_argument("--feature-cache-uri", type=str, default="") # s3://bucket/prefix shared with the training pipelines, empty to disable
     args = parser.parse_args()
 
     base_dir = "/opt/ml/processing"
-    pathlib.Path(f"{base_dir}/raw").mkdir(parents=True, exist_ok=True)
     input_data_lelang = args.input_data_lelang
     input_data_crawling = args.input_data_crawling
+    model_type = args.model_type
+    feature_cache_uri = args.feature_cache_uri
+
+    if feature_cache_uri:
+        ensure_parquet_engine()
     
     bucket_lelang = input_data_lelang.split("/")[2]
     key_lelang = "/".join(input_data_lelang.split("/")[3:])
@@ -38,28 +51,25 @@ if __name__ == "__main__":
     name_batch_out = "predict" # This variable MUST be the same as in postprocess.py
     
     s3_singapore = boto3.resource("s3", region_name="ap-southeast-1")
+    s3_virginia = boto3.resource("s3", region_name="us-east-1")
     
-    logger.info("Downloading lelang data from <%s/%s>...", bucket_lelang, key_lelang)
-    lelang_path = f"{base_dir}/raw/lelang.csv"
-    s3_singapore.Bucket(bucket_lelang).download_file(key_lelang, lelang_path)
-    
-    logger.info("Downloading crawling data from <%s/%s>...", bucket_crawling, key_crawling)
-    crawling_path = f"{base_dir}/raw/crawling.csv"
-    s3_singapore.Bucket(bucket_crawling).download_file(key_crawling, crawling_path)
-
-    logger.info("Reading lelang data...")
-    df_lelang = pd.read_csv(lelang_path)
-    os.unlink(lelang_path)
-    
-    logger.info("Reading crawling data...")
-    df_crawling = pd.read_csv(crawling_path)
-    os.unlink(crawling_path)
+    # Parsed while streaming from S3, without a copy on disk, all inputs at the same time
+    logger.info("Reading lelang data from <%s/%s>...", bucket_lelang, key_lelang)
+    logger.info("Reading crawling data from <%s/%s>...", bucket_crawling, key_crawling)
+    inputs = run_transfers({
+        "lelang": partial(read_csv, input_data_lelang, s3_singapore.meta.client),
+        # Built by the training pipeline of the same crawl when it ran first
+        "market_index": partial(load_market_index, feature_cache_uri, input_data_crawling, s3_singapore.meta.client, s3_virginia.meta.client)
+    })
+    df_lelang = inputs["lelang"]
+    market_index = inputs["market_index"]
     
     '''
     Add your own preprocessing step here!
     '''
     
-    df = df_lelang # You need to join df_lelang and df_crawling after/before you preprocess it
+    # Prices of the comparable crawled listings, the same features as in training
+    df = add_market_features(df_lelang, market_index, model_type)
 
     # unique_key = strftime("%Y%m%d-%H:%M:%S", gmtime())
     unique_key = strftime("%Y%m%d", gmtime())
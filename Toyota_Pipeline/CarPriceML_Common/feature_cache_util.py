@@ -0,0 +1,81 @@
+import hashlib
+import io
+import logging
+import os
+
+import pandas as pd
+
+from botocore.exceptions import ClientError
+
+import mapping_util
+import market_util
+
+from manifest_util import get_code_files_version
+from stream_util import get_source_version, is_s3, read_csv, split_s3_uri
+
+logger = logging.getLogger(__name__)
+
+# Features computed once per version of their inputs and code, in Parquet under the cache prefix, e.g.
+# s3://bucket/feature-cache/market-index/<version>.parquet. Training, HPO and batch transform share the entries
+# of the market index. The code version is the hash of the files computing the features, any edit invalidates them
+def get_cache_path(cache_uri, name, versions):
+    version = hashlib.sha256("-".join(versions).encode('utf-8')).hexdigest()[:16]
+    return f"{cache_uri.rstrip('/')}/{name}/{version}.parquet"
+
+def read_cache(cache_path, s3_client=None):
+    if is_s3(cache_path):
+        bucket, key = split_s3_uri(cache_path)
+        try:
+            body = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except s3_client.exceptions.NoSuchKey:
+            return None
+        return pd.read_parquet(io.BytesIO(body))
+
+    if not os.path.exists(cache_path):
+        return None
+    return pd.read_parquet(cache_path)
+
+def write_cache(df, cache_path, s3_client=None):
+    buffer = io.BytesIO()
+    df.columns = [str(column) for column in df.columns]
+    df.to_parquet(buffer, index=False)
+    if is_s3(cache_path):
+        # A single PUT, readers see the whole entry or none of it
+        bucket, key = split_s3_uri(cache_path)
+        s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+    else:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, cache_path)
+
+def load_features(cache_uri, name, versions, build, s3_client=None):
+    # 'build' computes the features on a miss, without a cache URI it is always called
+    if not cache_uri:
+        return build()
+
+    cache_path = get_cache_path(cache_uri, name, versions)
+    df = read_cache(cache_path, s3_client)
+    if df is not None:
+        logger.info("Loaded %s from the feature cache <%s>", name, cache_path)
+        return df
+
+    df = build()
+    try:
+        write_cache(df, cache_path, s3_client)
+        logger.info("Saved %s to the feature cache <%s>", name, cache_path)
+    except (ValueError, TypeError, OSError, ClientError) as e:
+        # Columns Parquet cannot type or a failed upload, the next run computes the features again
+        logger.warning("Could not save %s to the feature cache <%s>: %s", name, cache_path, e)
+    return df
+
+def load_market_index(cache_uri, crawling_uri, s3_client, cache_s3_client=None):
+    # Only depends on the crawl, the training and batch transform runs of the same crawl share it.
+    # On a hit the crawling data is not even read
+    versions = [get_source_version(crawling_uri, s3_client), get_code_files_version(market_util.__file__, mapping_util.__file__)]
+
+    def build():
+        return market_util.build_market_index(read_csv(crawling_uri, s3_client))
+
+    return load_features(cache_uri, "market-index", versions, build, cache_s3_client)
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+import time
+
+from stream_util import get_source_version
+
+# One manifest per fingerprint of a Preprocess run, written after its splits are uploaded, e.g.
+# s3://bucket/<prefix>/<model_type>/_manifests/<fingerprint>.json
+MANIFEST_DIR = "_manifests"
+
+def get_code_files_version(*paths):
+    # Hash of the processing code, the script and every module of the directories next to it with their pinned requirements
+    digest = hashlib.sha256()
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith((".py", ".txt")))
+        else:
+            files = [path]
+        for file in files:
+            with open(file, 'rb') as f:
+                digest.update(os.path.basename(file).encode('utf-8'))
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def get_fingerprint(*parts):
+    # ETags of the inputs, the code version and every option the splits depend on
+    return hashlib.sha256("-".join(str(part) for part in parts).encode('utf-8')).hexdigest()[:16]
+
+def get_manifest_key(prefix, fingerprint):
+    return f"{prefix.strip('/')}/{MANIFEST_DIR}/{fingerprint}.json"
+
+def read_manifest(s3_client, bucket, key):
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(body)
+
+def write_manifest(s3_client, bucket, key, manifest):
+    manifest = dict(manifest, created_at=time.time())
+    s3_client.put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest, indent=2).encode('utf-8'))
+    return manifest
+
+def save_manifest(manifest, path):
+    # The copy read by the next steps of the pipeline through a PropertyFile
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+def has_objects(s3_client, objects):
+    # The objects of a manifest may have been removed by a lifecycle rule, or uploaded again by hand, since it
+    # was written. 'objects' are {'uri': ..., 'etag': ...}
+    for obj in objects:
+        try:
+            if get_source_version(obj['uri'], s3_client) != obj['etag']:
+                return False
+        except s3_client.exceptions.ClientError:
+            return False
+    return True
@@ -0,0 +1,133 @@
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+# Shared by the crawler and the preprocessing of the pipelines, an identical copy lives in Crawling/ and in
+# Toyota_Pipeline/CarPriceML_Common/, so a lelang 'Type' gets the same keys on both sides of the market join
+DEFAULT = 'default'
+
+TRANSMISSION_MANUAL = 'manual'
+TRANSMISSION_AUTOMATIC = 'automatic'
+
+# Keys of a catalogue entry
+CATALOGUE_LABELS = 'labels'
+CATALOGUE_TYPES = 'types'
+CATALOGUE_CCS = 'ccs'
+
+COL_TYPE = 'Type'
+COL_TRANSMISI = 'transmisi'
+COL_TYPE_DETAIL = 'type_detail'
+COL_CC = 'cc'
+COL_BRAND = 'brand'
+COL_VARIANT = 'variant'
+
+# Carmudi variant slug of every lelang 'Type' for each brand, a brand comes from its own lelang file. Each variant has its
+# own type and cc tables. A label only matches up to the end of a token, so ' V' does not match ' VENTURER'
+CATALOGUE = {
+    'toyota': {
+        'avanza': {
+            CATALOGUE_LABELS: ['AVANZA'],
+            CATALOGUE_TYPES: {'G': [' G'], 'VELOZ': [' VELOZ'], 'E': [' E'], 'S': [' S'], DEFAULT: 'E'},
+            CATALOGUE_CCS: {'1.3': ['1.3'], '1.5': ['1.5'], DEFAULT: '1.3'}
+        },
+        'kijang-innova': {
+            CATALOGUE_LABELS: ['INNOVA'],
+            CATALOGUE_TYPES: {'VENTURER': [' VENTURER'], 'G': [' G'], 'V': [' V'], 'Q': [' Q'], DEFAULT: 'G'},
+            CATALOGUE_CCS: {'2.0': ['2.0'], '2.4': ['2.4'], '2.5': ['2.5'], '2.8': ['2.8'], DEFAULT: '2.0'}
+        },
+        'rush': {
+            CATALOGUE_LABELS: ['RUSH'],
+            CATALOGUE_TYPES: {'TRD': [' TRD'], 'G': [' G'], 'S': [' S'], DEFAULT: 'G'},
+            CATALOGUE_CCS: {'1.5': ['1.5'], DEFAULT: '1.5'}
+        },
+        'calya': {
+            CATALOGUE_LABELS: ['CALYA'],
+            CATALOGUE_TYPES: {'G': [' G'], 'E': [' E'], DEFAULT: 'G'},
+            CATALOGUE_CCS: {'1.2': ['1.2'], DEFAULT: '1.2'}
+        },
+        DEFAULT: 'avanza'
+    },
+    'daihatsu': {
+        'xenia': {
+            CATALOGUE_LABELS: ['XENIA'],
+            CATALOGUE_TYPES: {'R': [' R'], 'X': [' X'], 'M': [' M'], 'D': [' D'], DEFAULT: 'X'},
+            CATALOGUE_CCS: {'1.0': ['1.0'], '1.3': ['1.3'], '1.5': ['1.5'], DEFAULT: '1.3'}
+        },
+        'terios': {
+            CATALOGUE_LABELS: ['TERIOS'],
+            CATALOGUE_TYPES: {'TX': [' TX'], 'R': [' R'], 'X': [' X'], DEFAULT: 'X'},
+            CATALOGUE_CCS: {'1.5': ['1.5'], DEFAULT: '1.5'}
+        },
+        'sigra': {
+            CATALOGUE_LABELS: ['SIGRA'],
+            CATALOGUE_TYPES: {'R': [' R'], 'X': [' X'], 'M': [' M'], 'D': [' D'], DEFAULT: 'X'},
+            CATALOGUE_CCS: {'1.0': ['1.0'], '1.2': ['1.2'], DEFAULT: '1.2'}
+        },
+        'ayla': {
+            CATALOGUE_LABELS: ['AYLA'],
+            CATALOGUE_TYPES: {'R': [' R'], 'X': [' X'], 'M': [' M'], 'D': [' D'], DEFAULT: 'X'},
+            CATALOGUE_CCS: {'1.0': ['1.0'], '1.2': ['1.2'], DEFAULT: '1.2'}
+        },
+        DEFAULT: 'xenia'
+    }
+}
+
+map_transmission = {
+    TRANSMISSION_MANUAL: ['M/T', 'MT'],
+    TRANSMISSION_AUTOMATIC:['A/T', 'AT'],
+    DEFAULT: TRANSMISSION_MANUAL
+}
+
+def load_catalogue(path=None):
+    if path is None:
+        return CATALOGUE
+    with open(path) as f:
+        return json.load(f)
+
+LABEL_END = r'(?![\w/])' # A label ends with its token, so ' M' matches neither ' MATIC' nor the transmission ' M/T'
+
+def get_label_patterns(dict_label):
+    # One alternation regex for each label, kept in the dict order so the first matching label wins
+    return {key: '|'.join(re.escape(label) + LABEL_END for label in labels) for key, labels in dict_label.items() if key != DEFAULT}
+
+def get_variant_labels(variants):
+    return {variant: entry if variant == DEFAULT else entry[CATALOGUE_LABELS] for variant, entry in variants.items()}
+
+def get_column_mapping(df, origin_column, dict_label):
+    # 'Type' values repeat heavily, so only the unique values are matched and the labels are broadcast back by their codes
+    codes, uniques = pd.factorize(df[origin_column])
+    uniques = pd.Series(uniques, dtype=object).astype(str)
+
+    label_patterns = get_label_patterns(dict_label)
+    conditions = [uniques.str.contains(pattern, regex=True).to_numpy(dtype=bool) for pattern in label_patterns.values()]
+    labels = np.select(conditions, list(label_patterns.keys()), default=dict_label[DEFAULT]).astype(object)
+
+    # Missing values get the code -1, which picks the default label appended at the end
+    labels = np.append(labels, dict_label[DEFAULT])
+    return pd.Series(labels[codes], index=df.index)
+
+def map_lelang_type(df_lelang, catalogue=None):
+    # Adds the columns derived from the full lelang 'Type', e.g. 'AVANZA 1.3 G M/T', for the brand of each row
+    catalogue = catalogue or CATALOGUE
+    unknown = sorted(set(df_lelang[COL_BRAND].dropna()) - set(catalogue))
+    if unknown:
+        raise ValueError(f"Brands {unknown} are missing from the catalogue.")
+
+    # Extract 'transmisi' from 'Type' column
+    df_lelang[COL_TRANSMISI] = get_column_mapping(df_lelang, COL_TYPE, map_transmission)
+
+    # Extract 'variant' from 'Type' column with the catalogue of the brand
+    df_lelang[COL_VARIANT] = None
+    for brand, df_brand in df_lelang.groupby(COL_BRAND, sort=False):
+        df_lelang.loc[df_brand.index, COL_VARIANT] = get_column_mapping(df_brand, COL_TYPE, get_variant_labels(catalogue[brand]))
+
+    # Extract 'type_detail' and 'cc' from 'Type' column with the tables of the variant
+    df_lelang[COL_TYPE_DETAIL] = None
+    df_lelang[COL_CC] = None
+    for (brand, variant), df_variant in df_lelang.groupby([COL_BRAND, COL_VARIANT], sort=False):
+        entry = catalogue[brand][variant]
+        df_lelang.loc[df_variant.index, COL_TYPE_DETAIL] = get_column_mapping(df_variant, COL_TYPE, entry[CATALOGUE_TYPES])
+        df_lelang.loc[df_variant.index, COL_CC] = get_column_mapping(df_variant, COL_TYPE, entry[CATALOGUE_CCS])
+    return df_lelang
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from mapping_util import COL_BRAND, COL_TYPE_DETAIL, map_lelang_type
+
+# Columns of the crawling output, see fan_out_listings in Crawling/carmudi-crawling-refactored.py.
+# Its 'Type' is the type_detail of the lelang 'Type', e.g. 'G' for 'AVANZA 1.3 G M/T'
+COL_PRICE = 'price'
+COL_TYPE = 'Type'
+COL_CC = 'cc'
+COL_TRANSMISI = 'transmisi'
+COL_TAHUN = 'tahun'
+COL_VARIANT = 'variant'
+COL_LISTING_ID = 'listing_id'
+GROUP_COLUMNS = [COL_VARIANT, COL_TYPE, COL_CC, COL_TRANSMISI]
+
+COL_COUNT = 'market_count'
+QUANTILES = {'market_p25': 0.25, 'market_median': 0.5, 'market_p75': 0.75}
+FEATURE_COLUMNS = [COL_COUNT] + list(QUANTILES)
+MAX_YEAR_GAP = 2 # A lelang row without listings of its own year takes the closest year at most this far
+
+def check_columns(df, columns, name):
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        raise ValueError(f"Columns {missing} are missing from the {name} data, no market price can be looked up.")
+
+def get_group_columns(index):
+    return [column for column in index.columns if column not in [COL_TAHUN] + FEATURE_COLUMNS]
+
+def get_key(column):
+    # Numbers go through the same float formatting, cc is parsed as int or as float when it has gaps
+    if pd.api.types.is_numeric_dtype(column):
+        return column.astype('Float64').astype(str)
+    return column.astype(str).str.strip()
+
+def get_keys(df, group_columns):
+    # Same key dtypes on both sides of the join, whatever the CSV parser inferred
+    keys = pd.DataFrame({column: get_key(df[column]) for column in group_columns}, index=df.index)
+    keys[COL_TAHUN] = pd.to_numeric(df[COL_TAHUN], errors='coerce').fillna(-1).astype(np.int64)
+    return keys
+
+def get_empty_index(keys, group_columns):
+    # Same key dtypes as the keys of a lookup, merge_asof refuses keys of different types
+    index = keys[group_columns + [COL_TAHUN]].reset_index(drop=True)
+    index[COL_COUNT] = pd.Series(dtype=np.int64)
+    for column in QUANTILES:
+        index[column] = pd.Series(dtype=np.float64)
+    return index[group_columns + [COL_TAHUN] + FEATURE_COLUMNS]
+
+def build_market_index(df_crawling):
+    # One row per group and tahun with the number of listings and their price quantiles, sorted by tahun
+    # as merge_asof needs it. Built once per crawl, every lookup is then a binary search.
+    # Crawls written before the transmisi column was added are grouped by Type and cc only
+    check_columns(df_crawling, [COL_PRICE, COL_TAHUN], "crawling")
+    group_columns = [column for column in GROUP_COLUMNS if column in df_crawling.columns]
+    keys = get_keys(df_crawling, group_columns)
+    keys[COL_PRICE] = pd.to_numeric(df_crawling[COL_PRICE], errors='coerce')
+    keys[COL_LISTING_ID] = None
+    if COL_LISTING_ID in df_crawling.columns:
+        keys[COL_LISTING_ID] = get_key(df_crawling[COL_LISTING_ID]).where(df_crawling[COL_LISTING_ID].notna())
+    keys = keys[keys[COL_PRICE].notna() & (keys[COL_TAHUN] >= 0)]
+
+    # The crawler writes a listing once for every lelang row of its query, so it only counts once per group and tahun.
+    # Listings without an ID, and crawls written before the listing_id column was added, fall back to their price:
+    # two of them in the same group and year at the same price count as one
+    with_id = keys[COL_LISTING_ID].notna()
+    keys = pd.concat([
+        keys[with_id].drop_duplicates(group_columns + [COL_TAHUN, COL_LISTING_ID]),
+        keys[~with_id].drop_duplicates(group_columns + [COL_TAHUN, COL_PRICE])
+    ])
+    if keys.empty:
+        # No usable listing, every lelang row then gets NaN features
+        return get_empty_index(keys, group_columns)
+
+    grouped = keys.groupby(group_columns + [COL_TAHUN], sort=False)[COL_PRICE]
+    index = grouped.quantile(list(QUANTILES.values())).unstack()
+    index.columns = list(QUANTILES)
+    index[COL_COUNT] = grouped.size()
+    index = index.reset_index()
+    return index[group_columns + [COL_TAHUN] + FEATURE_COLUMNS].sort_values(COL_TAHUN, kind='stable', ignore_index=True)
+
+def get_lelang_keys(df_lelang, brand, group_columns):
+    # A lelang upload only has the full 'Type', its group is derived with the tables the crawler used
+    check_columns(df_lelang, [COL_TYPE, COL_TAHUN], "lelang")
+    df_type = map_lelang_type(pd.DataFrame({COL_TYPE: df_lelang[COL_TYPE], COL_BRAND: brand}, index=df_lelang.index))
+    df_keys = pd.DataFrame({
+        COL_VARIANT: df_type[COL_VARIANT],
+        COL_TYPE: df_type[COL_TYPE_DETAIL],
+        COL_CC: pd.to_numeric(df_type[COL_CC], errors='coerce'),
+        COL_TRANSMISI: df_type[COL_TRANSMISI],
+        COL_TAHUN: df_lelang[COL_TAHUN]
+    }, index=df_lelang.index)
+    return get_keys(df_keys, group_columns)
+
+def lookup_market_prices(df_lelang, index, brand, max_year_gap=MAX_YEAR_GAP):
+    # The statistics of the nearest listed tahun of the same group, NaN when there is none close enough
+    group_columns = get_group_columns(index)
+    keys = get_lelang_keys(df_lelang, brand, group_columns)
+    keys['position'] = np.arange(len(keys))
+    keys = keys.sort_values(COL_TAHUN, kind='stable')
+
+    matched = pd.merge_asof(keys, index, on=COL_TAHUN, by=group_columns or None,
+                            direction='nearest', tolerance=max_year_gap)
+    # Back to the lelang row order
+    matched = matched.iloc[np.argsort(matched['position'].to_numpy(), kind='stable')]
+    return matched[FEATURE_COLUMNS].set_index(df_lelang.index)
+
+def add_market_features(df_lelang, index, brand):
+    # Appended after the lelang columns, so the label stays first. Training, HPO and batch transform call it
+    # with the index of the same crawl and get the same features. 'brand' is the model type of the pipeline
+    return pd.concat([df_lelang, lookup_market_prices(df_lelang, index, brand)], axis=1)
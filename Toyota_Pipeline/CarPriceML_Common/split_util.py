@@ -0,0 +1,98 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+SPLIT_METHOD_HASH = "hash" # A row keeps its split across the daily runs
+SPLIT_METHOD_PERMUTATION = "permutation" # Exact split sizes, rows move between splits whenever the data changes
+SPLITS = ["train", "validation", "test"] # Position in the list is the split code of a row
+SPLIT_BUCKETS = 10000
+TEST_SIZE = 0.1
+VALIDATION_SIZE = 0.2 # Of the rows left after the test set, like the second train_test_split
+
+def get_hash_key(seed):
+    # hash_pandas_object takes a key of exactly 16 characters
+    return f"{seed:016d}"[-16:]
+
+def get_hash_values(column):
+    # hash_pandas_object hashes the bytes of the dtype, and one blank cell turns a chunk's int column into float.
+    # Numbers go through the same float formatting, so 2019 hashes the same whichever dtype the parser inferred
+    if pd.api.types.is_numeric_dtype(column):
+        return column.astype('Float64').astype(str)
+    return column.astype(str)
+
+def assign_splits(df, seed, test_size=TEST_SIZE, validation_size=VALIDATION_SIZE):
+    # The split of a row only depends on its values and the seed, not on the chunk it is read in
+    values = pd.DataFrame({column: get_hash_values(df[column]) for column in df.columns}, index=df.index)
+    hashes = pd.util.hash_pandas_object(values, index=False, hash_key=get_hash_key(seed)).to_numpy()
+    buckets = hashes % SPLIT_BUCKETS
+    test_cut = int(round(test_size * SPLIT_BUCKETS))
+    validation_cut = test_cut + int(round((1 - test_size) * validation_size * SPLIT_BUCKETS))
+    return np.where(buckets < test_cut, 2, np.where(buckets < validation_cut, 1, 0)).astype(np.int8)
+
+def permute_splits(num_rows, seed, test_size=TEST_SIZE, validation_size=VALIDATION_SIZE):
+    # Same sizes as the two train_test_split calls, without splitting and concatenating the DataFrames
+    num_test = int(math.ceil(test_size * num_rows))
+    num_validation = int(math.ceil(validation_size * (num_rows - num_test)))
+    order = np.random.RandomState(seed).permutation(num_rows)
+    splits = np.zeros(num_rows, dtype=np.int8)
+    splits[order[:num_test]] = 2
+    splits[order[num_test:num_test + num_validation]] = 1
+    return splits
+
+def get_splits(df, seed, method=SPLIT_METHOD_HASH, key_columns=None):
+    # One split code per row, the rows themselves are not copied. Only 'key_columns' are hashed when given
+    if method == SPLIT_METHOD_PERMUTATION:
+        return permute_splits(len(df), seed)
+    return assign_splits(df if key_columns is None else df[key_columns], seed)
+
+class SplitWriter:
+    # Appends the rows of every chunk to the file of their split, only one chunk is ever in memory
+    def __init__(self, paths, dataset_format):
+        self.paths = paths # Split name to file path
+        self.dataset_format = dataset_format
+        self.writers = {}
+        self.rows = {split: 0 for split in paths}
+
+    def write_split(self, split, df):
+        df.columns = [str(column) for column in df.columns]
+        if self.dataset_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            if split not in self.writers:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                self.writers[split] = pq.ParquetWriter(self.paths[split], table.schema)
+            else:
+                # Cast to the schema of the first chunk, a later chunk may infer other types
+                table = pa.Table.from_pandas(df, schema=self.writers[split].schema, preserve_index=False)
+            self.writers[split].write_table(table)
+        else:
+            if split not in self.writers:
+                self.writers[split] = open(self.paths[split], 'w', newline='')
+            df.to_csv(self.writers[split], header=False, index=False)
+        self.rows[split] += len(df)
+
+    def write_chunk(self, df, splits):
+        # Each split is taken from 'df' once and written, the label stays in the first column
+        for code, split in enumerate(SPLITS):
+            mask = splits == code
+            if mask.any():
+                self.write_split(split, df[mask])
+
+    def close(self):
+        for split, writer in self.writers.items():
+            writer.close()
+        # A split without any row still gets its (empty) file, a Parquet one with the schema of the other splits
+        for split, path in self.paths.items():
+            if split in self.writers:
+                continue
+            if self.dataset_format == "parquet":
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                schema = next((writer.schema for writer in self.writers.values()), pa.schema([]))
+                pq.write_table(schema.empty_table(), path)
+            else:
+                open(path, 'w').close()
+        return self.rows
@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+from contextlib import closing
+
+# Shared by the processing scripts of every pipeline, shipped to /opt/ml/processing/input/CarPriceML_Common
+# by a ProcessingInput, next to the script in /opt/ml/processing/input/code
+DEFAULT_CHUNK_ROWS = 100000
+REQUIREMENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "requirements.txt")
+
+def ensure_parquet_engine(requirements_path=REQUIREMENTS_PATH):
+    # The SKLearn processing image does not ship a Parquet engine, the versions pinned next to the shared modules
+    # are installed then. An image that already has pyarrow installs nothing
+    try:
+        import pyarrow
+    except ImportError:
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "--no-cache-dir", "-r", requirements_path])
+
+def is_s3(uri):
+    return uri.startswith("s3://")
+
+def split_s3_uri(uri):
+    bucket, key = uri.replace("s3://", "").split("/", 1)
+    return bucket, key
+
+def get_source_version(uri, s3_client=None):
+    # The ETag changes with every upload of the object, a local file is identified by its size and mtime
+    if is_s3(uri):
+        bucket, key = split_s3_uri(uri)
+        return s3_client.head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+    stat = os.stat(uri.replace("file://", ""))
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+def open_input(uri, s3_client=None):
+    # S3 objects are read straight from the response stream, local paths are opened as files for tests
+    if is_s3(uri):
+        bucket, key = split_s3_uri(uri)
+        return s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    return open(uri.replace("file://", ""), 'rb')
+
+def read_csv(uri, s3_client=None, chunk_rows=None, **kwargs):
+    # With 'chunk_rows', an iterator of DataFrames parsed while the object is being read, the file is never on disk
+    stream = open_input(uri, s3_client)
+    if chunk_rows is None:
+        with closing(stream):
+            return pd.read_csv(stream, **kwargs)
+    return iter_csv(stream, chunk_rows, **kwargs)
+
+def iter_csv(stream, chunk_rows=DEFAULT_CHUNK_ROWS, **kwargs):
+    with closing(stream):
+        for chunk in pd.read_csv(stream, chunksize=chunk_rows, **kwargs):
+            yield chunk
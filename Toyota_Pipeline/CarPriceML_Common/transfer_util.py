@@ -0,0 +1,44 @@
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+DEFAULT_MAX_WORKERS = 4 # Objects transferred at the same time
+
+# Every object larger than the threshold is sent in parts of 'multipart_chunksize' over 'max_concurrency' threads
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * MB,
+    multipart_chunksize=16 * MB,
+    max_concurrency=8,
+    use_threads=True
+)
+
+def upload_file(s3_client, path, bucket, key, config=TRANSFER_CONFIG):
+    return s3_client.upload_file(path, Bucket=bucket, Key=key, Config=config)
+
+def run_transfers(transfers, max_workers=DEFAULT_MAX_WORKERS):
+    # 'transfers' maps a name to a function without arguments, S3 clients are thread safe but resources are not
+    durations = {}
+
+    def run(name, transfer):
+        start_time = time.perf_counter()
+        try:
+            return transfer()
+        finally:
+            durations[name] = time.perf_counter() - start_time
+            logger.info("Transfer of %s took %.2f seconds", name, durations[name])
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(transfers)))) as executor:
+        futures = {name: executor.submit(run, name, transfer) for name, transfer in transfers.items()}
+        results = {name: future.result() for name, future in futures.items()}
+    wall_time = time.perf_counter() - start_time
+
+    serial_time = sum(durations.values())
+    logger.info("%d transfers took %.2f seconds instead of %.2f seconds one after the other, %.2f seconds saved",
+                len(transfers), wall_time, serial_time, serial_time - wall_time)
+    return results
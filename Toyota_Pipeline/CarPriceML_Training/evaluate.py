@@ -16,12 +16,21 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
+DATASET_FORMAT_CSV = "csv"
+DATASET_FORMAT_PARQUET = "parquet"
+
+def read_dataset(path, dataset_format):
+    if dataset_format == DATASET_FORMAT_PARQUET:
+        return pd.read_parquet(path)
+    return pd.read_csv(path, header=None)
+
 if __name__ == "__main__":
     logger.info("Starting evaluation...")
     parser = argparse.ArgumentParser()
     parser.add_argument("--default-bucket", type=str, required=True)
     parser.add_argument("--model-type", type=str, required=True)
     parser.add_argument("--prefix-evaluation", type=str, required=True)
+    parser.add_argument("--dataset-format", type=str, choices=[DATASET_FORMAT_CSV, DATASET_FORMAT_PARQUET], default=DATASET_FORMAT_CSV)
     args = parser.parse_args()
     
     default_bucket = args.default_bucket # To save evaluation report
@@ -43,8 +52,8 @@ if __name__ == "__main__":
     model.load_model("xgboost-model")
 
     logger.info("Reading test data...")
-    test_path = "/opt/ml/processing/test/test.csv"
-    df = pd.read_csv(test_path, header=None)
+    test_path = f"/opt/ml/processing/test/test.{args.dataset_format}"
+    df = read_dataset(test_path, args.dataset_format)
 
     y_test = df.iloc[:, 0].to_numpy()
     df.drop(df.columns[0], axis=1, inplace=True)
@@ -1,5 +1,6 @@
 # Pipeline for Training With Constant
 import os
+import sys
 import boto3
 import sagemaker
 import sagemaker.session
@@ -10,7 +11,9 @@ from sagemaker.model import Model
 from sagemaker.processing import ProcessingInput, ProcessingOutput, ScriptProcessor
 from sagemaker.sklearn.processing import SKLearnProcessor
 from sagemaker.workflow.parameters import ParameterInteger, ParameterString, ParameterFloat
+from sagemaker.workflow.functions import JsonGet
 from sagemaker.workflow.pipeline import Pipeline
+from sagemaker.workflow.properties import PropertyFile
 from sagemaker.workflow.steps import ProcessingStep, TrainingStep, CacheConfig
 from sagemaker.workflow.model_step import ModelStep
 from sagemaker.workflow.pipeline_context import PipelineSession
@@ -24,11 +27,25 @@ PREFIX_PREPROCESS = "glair-bcaf-consultation-output/training"
 PREFIX_MODEL = "glair-bcaf-consultation-output/model"
 PREFIX_EVALUATION = "glair-bcaf-consultation-output/evaluation"
 MODEL_TYPE = "toyota"
+FEATURE_CACHE_PREFIX = "glair-bcaf-consultation-output/feature-cache" # Features shared by the Training, HPO and BatchTransform pipelines, None to disable
+DATASET_FORMAT = "csv" # "csv" or "parquet" for the train, validation and test sets
+CHUNK_ROWS = 0 # Lelang rows preprocessed at a time, 0 loads the inputs in memory, e.g. 500000 for exports larger than the RAM
+SPLIT_METHOD = "hash" # "hash" keeps every row in its split across runs, "permutation" gives exact split sizes (with CHUNK_ROWS = 0 only)
 '''
 Edit above section only according to your needs!
 '''
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+COMMON_DIR = os.path.join(BASE_DIR, "..", "CarPriceML_Common") # Modules shared by the processing scripts of every pipeline
+
+sys.path.append(COMMON_DIR)
+from manifest_util import get_code_files_version
+
+# Content types of the dataset formats for the SageMaker XGBoost container
+CONTENT_TYPES = {
+    "csv": "csv",
+    "parquet": "application/x-parquet"
+}
 
 def get_sagemaker_session(region, default_bucket):
     boto_session = boto3.Session(region_name=region)
@@ -82,6 +99,9 @@ def get_pipeline(
     
     input_data_lelang = ParameterString(name="InputDataLelangURI")
     input_data_crawling = ParameterString(name="InputDataCrawlingURI")
+    # ETags of the two inputs, see get_input_fingerprint in latest_util.py. Without a default, so no execution
+    # reuses a cached Preprocess step on the input URIs alone
+    input_fingerprint = ParameterString(name="InputFingerprint")
     
     max_depth = ParameterInteger(name="MaxDepth", default_value=5)
     subsample = ParameterFloat(name="SubSample", default_value=0.9)
@@ -109,6 +129,13 @@ def get_pipeline(
         },
     ]    
     
+    # Shared modules, placed next to the script directory /opt/ml/processing/input/code
+    common_input = ProcessingInput(
+        source=COMMON_DIR,
+        destination="/opt/ml/processing/input/CarPriceML_Common",
+        input_name="common"
+    )
+
     # Preprocess step
     sklearn_processor = SKLearnProcessor(
         framework_version="0.23-1",
@@ -120,22 +147,31 @@ def get_pipeline(
     )
 
     step_args = sklearn_processor.run(
+        inputs=[common_input],
         outputs=[
-            ProcessingOutput(output_name="train", source="/opt/ml/processing/train"),
-            ProcessingOutput(output_name="validation", source="/opt/ml/processing/validation"),
-            ProcessingOutput(output_name="test", source="/opt/ml/processing/test"),
+            # The splits are published once by the script to PREFIX_PREPROCESS, only their manifest is an output
+            ProcessingOutput(output_name="manifest", source="/opt/ml/processing/manifest")
         ],
         code=os.path.join(BASE_DIR, "preprocess.py"),
         arguments=["--input-data-lelang", input_data_lelang,
                    "--input-data-crawling", input_data_crawling,
                    "--default-bucket", DEFAULT_BUCKET,
                    "--model-type", MODEL_TYPE,
-                   "--prefix-preprocess", PREFIX_PREPROCESS]
+                   "--prefix-preprocess", PREFIX_PREPROCESS,
+                   "--dataset-format", DATASET_FORMAT,
+                   "--chunk-rows", str(CHUNK_ROWS),
+                   "--split-method", SPLIT_METHOD,
+                   "--input-fingerprint", input_fingerprint,
+                   "--code-version", get_code_files_version(os.path.join(BASE_DIR, "preprocess.py"), COMMON_DIR)]
+                  + (["--feature-cache-uri", f"s3://{DEFAULT_BUCKET}/{FEATURE_CACHE_PREFIX}"] if FEATURE_CACHE_PREFIX else [])
     )
 
+    manifest_file = PropertyFile(name="PreprocessManifest", output_name="manifest", path="manifest.json")
     step_preprocess = ProcessingStep(
         name=f"{MODEL_TYPE.capitalize()}-CarPriceML-Preprocess",
-        step_args=step_args      
+        step_args=step_args,
+        property_files=[manifest_file],
+        cache_config=cache_config
     )
 
     # unique_key = strftime("%Y%m%d-%H:%M:%S", gmtime())
@@ -177,9 +213,9 @@ def get_pipeline(
     step_args = xgb.fit(
         inputs={
             "train": TrainingInput(
-                s3_data=step_preprocess.properties.ProcessingOutputConfig.Outputs["train"].S3Output.S3Uri, content_type="csv"),
+                s3_data=JsonGet(step_name=step_preprocess.name, property_file=manifest_file, json_path="splits.train.uri"), content_type=CONTENT_TYPES[DATASET_FORMAT]),
             "validation": TrainingInput(
-                s3_data=step_preprocess.properties.ProcessingOutputConfig.Outputs["validation"].S3Output.S3Uri, content_type="csv")
+                s3_data=JsonGet(step_name=step_preprocess.name, property_file=manifest_file, json_path="splits.validation.uri"), content_type=CONTENT_TYPES[DATASET_FORMAT])
         }
     )
 
@@ -226,7 +262,7 @@ def get_pipeline(
                 destination="/opt/ml/processing/model"
             ),
             ProcessingInput(
-                source=step_preprocess.properties.ProcessingOutputConfig.Outputs["test"].S3Output.S3Uri,
+                source=JsonGet(step_name=step_preprocess.name, property_file=manifest_file, json_path="splits.test.uri"),
                 destination="/opt/ml/processing/test"
             )
         ],
@@ -236,7 +272,8 @@ def get_pipeline(
         code=os.path.join(BASE_DIR, "evaluate.py"),
         arguments=["--default-bucket", DEFAULT_BUCKET,
                    "--model-type", MODEL_TYPE,
-                   "--prefix-evaluation", PREFIX_EVALUATION]
+                   "--prefix-evaluation", PREFIX_EVALUATION,
+                   "--dataset-format", DATASET_FORMAT]
     )
     
     step_eval = ProcessingStep(
@@ -254,6 +291,7 @@ def get_pipeline(
             training_instance_count,
             input_data_lelang,
             input_data_crawling,
+            input_fingerprint,
             max_depth,
             subsample,
             colsample_bytree,
@@ -2,21 +2,49 @@
 import argparse
 import logging
 import os
-import pathlib
+import sys
 import boto3
-import pandas as pd
 
+from functools import partial
 from time import gmtime, strftime
-from sklearn.model_selection import train_test_split
 
 '''
 Add your required additional dependencies here!
 '''
 
+# Shared modules, shipped next to the script in the processing container
+COMMON_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "CarPriceML_Common")
+sys.path.append(COMMON_DIR)
+import mapping_util
+import market_util
+
+from feature_cache_util import load_features, load_market_index
+from manifest_util import get_code_files_version, get_fingerprint, get_manifest_key, has_objects, read_manifest, save_manifest, write_manifest
+from market_util import FEATURE_COLUMNS, add_market_features
+from split_util import SPLIT_METHOD_HASH, SPLIT_METHOD_PERMUTATION, SPLITS, SplitWriter, get_splits
+from stream_util import ensure_parquet_engine, get_source_version, read_csv, split_s3_uri
+from transfer_util import run_transfers, upload_file
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
+DATASET_FORMAT_CSV = "csv"
+DATASET_FORMAT_PARQUET = "parquet"
+SPLIT_SEED = 293 # Seed of the row hashes or of the permutation
+
+def get_key_columns(df):
+    # The market prices change with every crawl, a row keeps its split as long as its own values do not
+    return [column for column in df.columns if column not in FEATURE_COLUMNS]
+
+def preprocess(df_lelang, market_index, model_type):
+    '''
+    Add your own preprocessing step here!
+    '''
+    # With --chunk-rows, called once per chunk of lelang rows
+    # Prices of the comparable crawled listings, the same features as in the batch transform
+    return add_market_features(df_lelang, market_index, model_type)
+
 if __name__ == "__main__":
     logger.info("Starting preprocessing...")
     parser = argparse.ArgumentParser()
@@ -25,15 +53,31 @@ if __name__ == "__main__":
     parser.add_argument("--default-bucket", type=str, required=True)
     parser.add_argument("--model-type", type=str, required=True)
     parser.add_argument("--prefix-preprocess", type=str, required=True)
+    parser.add_argument("--dataset-format", type=str, choices=[DATASET_FORMAT_CSV, DATASET_FORMAT_PARQUET], default=DATASET_FORMAT_CSV)
+    parser.add_argument("--chunk-rows", type=int, default=0) # 0 loads the inputs in memory
+    parser.add_argument("--split-method", type=str, choices=[SPLIT_METHOD_HASH, SPLIT_METHOD_PERMUTATION], default=SPLIT_METHOD_HASH)
+    parser.add_argument("--feature-cache-uri", type=str, default="") # s3://bucket/prefix shared with the other pipelines, empty to disable
+    # Only there so the cache key of the Preprocess step changes with the inputs and the code
+    parser.add_argument("--input-fingerprint", type=str, default="")
+    parser.add_argument("--code-version", type=str, default="")
     args = parser.parse_args()
+    if args.chunk_rows > 0 and args.split_method == SPLIT_METHOD_PERMUTATION:
+        # The permutation needs the number of rows before the first chunk is written
+        parser.error("--split-method permutation needs the inputs in memory, use --chunk-rows 0 or --split-method hash")
 
     base_dir = "/opt/ml/processing"
-    pathlib.Path(f"{base_dir}/raw").mkdir(parents=True, exist_ok=True)
     input_data_lelang = args.input_data_lelang
     input_data_crawling = args.input_data_crawling
     default_bucket = args.default_bucket # To save the train, val, test data
     model_type = args.model_type # To differentiate the models (e.g., Toyota, Honda, Suzuki)
     prefix_preprocess = args.prefix_preprocess
+    dataset_format = args.dataset_format
+    chunk_rows = args.chunk_rows
+    split_method = args.split_method
+    feature_cache_uri = args.feature_cache_uri
+
+    if dataset_format == DATASET_FORMAT_PARQUET or feature_cache_uri:
+        ensure_parquet_engine()
     
     bucket_lelang = input_data_lelang.split("/")[2]
     key_lelang = "/".join(input_data_lelang.split("/")[3:])
@@ -44,54 +88,95 @@ if __name__ == "__main__":
     s3_singapore = boto3.resource("s3", region_name="ap-southeast-1")
     s3_virginia = boto3.resource("s3", region_name="us-east-1")
     
-    logger.info("Downloading lelang data from <%s/%s>...", bucket_lelang, key_lelang)
-    lelang_path = f"{base_dir}/raw/lelang.csv"
-    s3_singapore.Bucket(bucket_lelang).download_file(key_lelang, lelang_path)
-    
-    logger.info("Downloading crawling data from <%s/%s>...", bucket_crawling, key_crawling)
-    crawling_path = f"{base_dir}/raw/crawling.csv"
-    s3_singapore.Bucket(bucket_crawling).download_file(key_crawling, crawling_path)
+    # Fingerprint of this run, an execution on the same inputs, code and options reuses the splits of the first one
+    version_lelang = get_source_version(input_data_lelang, s3_singapore.meta.client)
+    version_crawling = get_source_version(input_data_crawling, s3_singapore.meta.client)
+    code_version = get_code_files_version(os.path.realpath(__file__), COMMON_DIR)
+    fingerprint = get_fingerprint(version_lelang, version_crawling, code_version,
+                                  dataset_format, chunk_rows, split_method, SPLIT_SEED)
+    manifest_key = get_manifest_key(f"{prefix_preprocess}/{model_type}", fingerprint)
+    manifest = read_manifest(s3_virginia.meta.client, default_bucket, manifest_key)
 
-    logger.info("Reading lelang data...")
-    df_lelang = pd.read_csv(lelang_path)
-    os.unlink(lelang_path)
-    
-    logger.info("Reading crawling data...")
-    df_crawling = pd.read_csv(crawling_path)
-    os.unlink(crawling_path)
-    
-    '''
-    Add your own preprocessing step here!
-    '''
-    
-    df = df_lelang # You need to join df_lelang and df_crawling after/before you preprocess it
+    if manifest is not None and has_objects(s3_virginia.meta.client, manifest['splits'].values()):
+        # The next steps read the splits of the manifest, nothing is preprocessed nor uploaded again
+        logger.info("Reusing the datasets of <%s/%s>...", default_bucket, manifest_key)
+    else:
+        # Parsed while streaming from S3, without a copy on disk, all inputs at the same time
+        logger.info("Reading lelang data from <%s/%s>...", bucket_lelang, key_lelang)
+        logger.info("Reading crawling data from <%s/%s>...", bucket_crawling, key_crawling)
+        # Every row goes straight from the joined data to the file of its split
+        for split in SPLITS:
+            os.makedirs(f"{base_dir}/{split}", exist_ok=True)
+        writer = SplitWriter({split: f"{base_dir}/{split}/{split}.{dataset_format}" for split in SPLITS}, dataset_format)
+        try:
+            if chunk_rows > 0:
+                # Out of core: the lelang rows go through in chunks of 'chunk_rows', only the market index is cached
+                market_index = load_market_index(feature_cache_uri, input_data_crawling, s3_singapore.meta.client, s3_virginia.meta.client)
 
-    logger.info("Splitting rows of joined data into train, validation, test sets...")
-    # Separate the features and the target columns
-    X = df.drop(df.columns[0], axis=1)
-    y = df[df.columns[0]]
-    
-    # Splitting data into train, validation, and test sets
-    X_trainval, X_test, y_trainval, y_test = train_test_split(X, y, test_size=0.1, random_state=293)
-    X_train, X_val, y_train, y_val = train_test_split(X_trainval, y_trainval, test_size=0.2, random_state=342)
-
-    # Concatenate data
-    # The target column must in the first column
-    df_train = pd.concat([y_train, pd.DataFrame(X_train, index=X_train.index, columns=X_train.columns)], axis=1)
-    df_val = pd.concat([y_val, pd.DataFrame(X_val, index=X_val.index, columns=X_val.columns)], axis=1)
-    df_test = pd.concat([y_test, pd.DataFrame(X_test, index=X_test.index, columns=X_test.columns)], axis=1)
-
-    # unique_key = strftime("%Y%m%d-%H:%M:%S", gmtime())
-    unique_key = strftime("%Y%m%d", gmtime())
-    
-    # Save the data to base directory
-    logger.info("Writing out dataset to base directory...")
-    df_train.to_csv(f"{base_dir}/train/train.csv", header=False, index=False)
-    df_val.to_csv(f"{base_dir}/validation/validation.csv", header=False, index=False)
-    df_test.to_csv(f"{base_dir}/test/test.csv", header=False, index=False)
-    
-    # Upload the data to S3
-    logger.info("Writing out datasets to <%s>...", default_bucket)
-    s3_virginia.meta.client.upload_file(f"{base_dir}/train/train.csv", Bucket=default_bucket, Key=f"{prefix_preprocess}/{model_type}/train/{unique_key}/train.csv")
-    s3_virginia.meta.client.upload_file(f"{base_dir}/validation/validation.csv", Bucket=default_bucket, Key=f"{prefix_preprocess}/{model_type}/validation/{unique_key}/validation.csv")
-    s3_virginia.meta.client.upload_file(f"{base_dir}/test/test.csv", Bucket=default_bucket, Key=f"{prefix_preprocess}/{model_type}/test/{unique_key}/test.csv")
\ No newline at end of file
+                logger.info("Splitting rows of joined data into train, validation, test sets by chunks of %d rows...", chunk_rows)
+                for chunk in read_csv(input_data_lelang, s3_singapore.meta.client, chunk_rows=chunk_rows):
+                    df = preprocess(chunk, market_index, model_type)
+                    writer.write_chunk(df, get_splits(df, SPLIT_SEED, key_columns=get_key_columns(df))) # Hashes only, a permutation needs every row at once
+            else:
+                def build_features():
+                    inputs = run_transfers({
+                        "lelang": partial(read_csv, input_data_lelang, s3_singapore.meta.client),
+                        "market_index": partial(load_market_index, feature_cache_uri, input_data_crawling, s3_singapore.meta.client, s3_virginia.meta.client)
+                    })
+                    return preprocess(inputs["lelang"], inputs["market_index"], model_type)
+
+                # The preprocessed rows of this lelang file and crawl, reused by the next runs of this pipeline
+                versions = [
+                    version_lelang,
+                    version_crawling,
+                    get_code_files_version(os.path.realpath(__file__), market_util.__file__, mapping_util.__file__),
+                    model_type
+                ]
+                df = load_features(feature_cache_uri, "features", versions, build_features, s3_virginia.meta.client)
+
+                logger.info("Splitting rows of joined data into train, validation, test sets by %s...", split_method)
+                writer.write_chunk(df, get_splits(df, SPLIT_SEED, split_method, get_key_columns(df)))
+        finally:
+            rows = writer.close()
+        logger.info("Rows written per split: %s", rows)
+
+        # unique_key = strftime("%Y%m%d-%H:%M:%S", gmtime())
+        unique_key = strftime("%Y%m%d", gmtime())
+        # The fingerprint keeps apart the splits of the Training and HPO pipelines (other seeds) and of the runs of the same
+        # day with other inputs, so the objects of a manifest are never overwritten with other rows
+        split_uris = {
+            split: f"s3://{default_bucket}/{prefix_preprocess}/{model_type}/{split}/{unique_key}/{fingerprint}/{split}.{dataset_format}"
+            for split in SPLITS
+        }
+
+        # Published once, the training channels and the evaluation read the splits from there through the manifest
+        logger.info("Writing out datasets to <%s>...", default_bucket)
+        run_transfers({
+            split: partial(
+                upload_file,
+                s3_virginia.meta.client,
+                f"{base_dir}/{split}/{split}.{dataset_format}",
+                *split_s3_uri(uri)
+            )
+            for split, uri in split_uris.items()
+        })
+
+        # Written last, a run that fails before it leaves no manifest behind
+        manifest = write_manifest(s3_virginia.meta.client, default_bucket, manifest_key, {
+            'fingerprint': fingerprint,
+            'inputs': {
+                'lelang': {'uri': input_data_lelang, 'version': version_lelang},
+                'crawling': {'uri': input_data_crawling, 'version': version_crawling}
+            },
+            'code_version': code_version,
+            'dataset_format': dataset_format,
+            'split_method': split_method,
+            'rows': rows,
+            'splits': {
+                split: {'uri': uri, 'etag': get_source_version(uri, s3_virginia.meta.client)}
+                for split, uri in split_uris.items()
+            }
+        })
+        logger.info("Wrote manifest <%s/%s>", default_bucket, manifest_key)
+
+    save_manifest(manifest, f"{base_dir}/manifest/manifest.json")
\ No newline at end of file
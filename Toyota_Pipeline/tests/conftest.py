@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The shared modules are copied next to each pipeline script instead of being installed
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CarPriceML_Common'))
@@ -0,0 +1,28 @@
+import pandas as pd
+import pytest
+
+from mapping_util import COL_BRAND, COL_CC, COL_TRANSMISI, COL_TYPE, COL_TYPE_DETAIL, COL_VARIANT, map_lelang_type
+
+@pytest.mark.parametrize('brand, lelang_type, variant, type_detail, cc, transmisi', [
+    ('daihatsu', 'AYLA 1.0 D M/T', 'ayla', 'D', '1.0', 'manual'),
+    ('daihatsu', 'SIGRA 1.2 D M/T', 'sigra', 'D', '1.2', 'manual'),
+    ('daihatsu', 'XENIA 1.3 R M/T', 'xenia', 'R', '1.3', 'manual'),
+    ('daihatsu', 'XENIA 1.3 M A/T', 'xenia', 'M', '1.3', 'automatic'),
+    ('toyota', 'AVANZA 1.3 G M/T', 'avanza', 'G', '1.3', 'manual'),
+    ('toyota', 'AVANZA VELOZ 1.5 A/T', 'avanza', 'VELOZ', '1.5', 'automatic'),
+    ('toyota', 'AVANZA 1.5 G VELOZ M/T', 'avanza', 'G', '1.5', 'manual'),
+    ('toyota', 'INNOVA 2.4 V AT', 'kijang-innova', 'V', '2.4', 'automatic'),
+    ('toyota', 'INNOVA VENTURER 2.4 AT', 'kijang-innova', 'VENTURER', '2.4', 'automatic'),
+])
+def test_map_lelang_type(brand, lelang_type, variant, type_detail, cc, transmisi):
+    df = map_lelang_type(pd.DataFrame({COL_BRAND: [brand], COL_TYPE: [lelang_type]}))
+    assert df.loc[0, [COL_VARIANT, COL_TYPE_DETAIL, COL_CC, COL_TRANSMISI]].tolist() == [variant, type_detail, cc, transmisi]
+
+def test_map_lelang_type_defaults():
+    df = map_lelang_type(pd.DataFrame({COL_BRAND: ['toyota', 'toyota'], COL_TYPE: ['AVANZA', None]}))
+    assert df[COL_TYPE_DETAIL].tolist() == ['E', 'E']
+    assert df[COL_TRANSMISI].tolist() == ['manual', 'manual']
+
+def test_map_lelang_type_unknown_brand():
+    with pytest.raises(ValueError):
+        map_lelang_type(pd.DataFrame({COL_BRAND: ['honda'], COL_TYPE: ['JAZZ 1.5 RS A/T']}))
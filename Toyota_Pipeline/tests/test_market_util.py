@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from market_util import FEATURE_COLUMNS, GROUP_COLUMNS, COL_TAHUN, add_market_features, build_market_index
+
+BRAND = 'toyota'
+
+def get_crawling(prices, tahun=2019, listing_ids=None):
+    df = pd.DataFrame({
+        'price': prices,
+        'tahun': tahun,
+        'cc': '1.3',
+        'Type': 'G',
+        'brand': BRAND,
+        'variant': 'avanza',
+        'transmisi': 'manual'
+    })
+    if listing_ids is not None:
+        df['listing_id'] = listing_ids
+    return df
+
+def get_lelang():
+    return pd.DataFrame({'harga': [150000000, 90000000], 'Type': ['AVANZA 1.3 G M/T', 'AVANZA 1.5 VELOZ A/T'], 'tahun': [2020, 2019]})
+
+def test_market_features():
+    index = build_market_index(get_crawling([100000000, 120000000, 140000000]))
+    df = add_market_features(get_lelang(), index, BRAND)
+    assert list(df.columns) == list(get_lelang().columns) + FEATURE_COLUMNS
+    assert df.loc[0, 'market_count'] == 3 and df.loc[0, 'market_median'] == 120000000
+    assert df.loc[1, FEATURE_COLUMNS].isna().all()
+
+def test_empty_market_index():
+    index = build_market_index(get_crawling([np.nan, np.nan]))
+    assert index.empty
+    assert list(index.columns) == GROUP_COLUMNS + [COL_TAHUN] + FEATURE_COLUMNS
+
+    df = add_market_features(get_lelang(), index, BRAND)
+    assert df[FEATURE_COLUMNS].isna().all().all()
+
+def test_market_index_counts_listings_by_id():
+    # Listing 1 is repeated by the fan out to two lelang rows, listings 2 and 3 share a price
+    index = build_market_index(get_crawling([100000000, 100000000, 120000000, 120000000], listing_ids=[1, 1, 2, 3]))
+    assert index['market_count'].tolist() == [3]
+
+def test_market_index_without_listing_ids():
+    # Rows without an ID and crawls without the column count one listing per price
+    assert build_market_index(get_crawling([100000000, 100000000, 120000000], listing_ids=[None, None, '3']))['market_count'].tolist() == [2]
+    assert build_market_index(get_crawling([100000000, 100000000, 120000000]))['market_count'].tolist() == [2]
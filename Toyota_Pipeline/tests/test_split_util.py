@@ -0,0 +1,49 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from split_util import SPLITS, SplitWriter, assign_splits, get_splits
+
+SEED = 42
+
+def get_csv(num_rows=200):
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({
+        'price': rng.randint(50, 300, num_rows) * 1000000,
+        'tahun': rng.randint(2010, 2023, num_rows),
+        'cc': rng.choice([1300, 1500], num_rows),
+        'transmisi': rng.choice(['manual', 'automatic'], num_rows)
+    })
+    # One blank cell turns the 'tahun' column of its chunk into floats
+    df['tahun'] = df['tahun'].astype(object)
+    df.loc[num_rows - 3, 'tahun'] = None
+    return df.to_csv(index=False)
+
+@pytest.mark.parametrize('chunksize', [1, 7, 100])
+def test_splits_do_not_depend_on_chunks(chunksize):
+    csv = get_csv()
+    expected = get_splits(pd.read_csv(io.StringIO(csv)), SEED)
+    splits = np.concatenate([get_splits(df, SEED) for df in pd.read_csv(io.StringIO(csv), chunksize=chunksize)])
+    np.testing.assert_array_equal(splits, expected)
+
+def test_splits_do_not_depend_on_dtypes():
+    df_int = pd.DataFrame({'price': [100000000, 150000000], 'tahun': [2019, 2020]})
+    df_float = pd.DataFrame({'price': [100000000.0, 150000000.0, 90000000.0], 'tahun': [2019.0, 2020.0, np.nan]})
+    np.testing.assert_array_equal(assign_splits(df_int, SEED), assign_splits(df_float, SEED)[:2])
+
+def test_split_sizes():
+    df = pd.read_csv(io.StringIO(get_csv(5000)))
+    counts = np.bincount(get_splits(df, SEED), minlength=len(SPLITS)) / len(df)
+    np.testing.assert_allclose(counts, [0.72, 0.18, 0.1], atol=0.03)
+
+def test_empty_parquet_split(tmp_path):
+    pytest.importorskip('pyarrow')
+    paths = {split: str(tmp_path / f"{split}.parquet") for split in SPLITS}
+    writer = SplitWriter(paths, "parquet")
+    writer.write_chunk(pd.DataFrame({'price': [1.0, 2.0], 'tahun': [2019, 2020]}), np.array([0, 1], dtype=np.int8))
+    assert writer.close() == {'train': 1, 'validation': 1, 'test': 0}
+
+    df_test = pd.read_parquet(paths['test'])
+    assert list(df_test.columns) == ['price', 'tahun'] and len(df_test) == 0